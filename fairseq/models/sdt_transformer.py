@@ -10,25 +10,26 @@ import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from collections import OrderedDict
+from torch.utils.checkpoint import checkpoint
 
 from fairseq import options, utils
 from fairseq.modules import (
-    AdaptiveInput, AdaptiveSoftmax, CharacterTokenEmbedder, LayerNorm,
-    LearnedPositionalEmbedding, MultiheadAttention, SinusoidalPositionalEmbedding,
-    RelativeMultiheadAttention,
+    AdaptiveInput, AdaptiveSoftmax, CharacterTokenEmbedder, Int8Linear, LayerNorm,
+    LearnedPositionalEmbedding, MultiheadAttention, RMSNorm, SinusoidalPositionalEmbedding,
+    RelativeMultiheadAttention, dropout_add, linear_relu_dropout, scale_add_dropout,
 )
 
 from . import (
     FairseqIncrementalDecoder, FairseqEncoder, FairseqLanguageModel,
     FairseqModel, register_model, register_model_architecture,
 )
+from fairseq.modules.fp8_kv_cache import HAS_FP8
 from fairseq.modules.layer_history import CreateLayerHistory
-import fairseq.utils as util
-import numpy as np
 
-np.set_printoptions(threshold=np.inf)
-np.set_printoptions(linewidth=np.inf)
+# encoder depth from which the t2t variants recompute layer activations in
+# the backward pass unless --no-checkpoint-activations is given
+_CHECKPOINT_MIN_LAYERS = 54
+
 
 @register_model('sdt_transformer')
 class SdtTransformerModel(FairseqModel):
@@ -48,8 +49,9 @@ class SdtTransformerModel(FairseqModel):
         :prog:
     """
 
-    def __init__(self, encoder, decoder):
+    def __init__(self, encoder, decoder, bf16_autocast=False):
         super().__init__(encoder, decoder)
+        self.bf16_autocast = bf16_autocast
 
     @staticmethod
     def add_args(parser):
@@ -116,9 +118,40 @@ class SdtTransformerModel(FairseqModel):
                             help='encoder layer integration type')
         parser.add_argument('--decoder-integration-type', choices=['avg', 'sum'],
                             help='decoder layer integration type')
+        parser.add_argument('--history-softmax-weight', default=False, action='store_true',
+                            help='normalize the dense layer weights with a softmax over the '
+                                 'visible layers instead of regularizing their row sums; not '
+                                 'compatible with checkpoints trained without it')
 
         parser.add_argument('--inspect-grad', default=False, action='store_true',
-                            help='inspect intermediate gradient')
+                            help='deprecated, has no effect')
+        parser.add_argument('--checkpoint-activations', default=None, action='store_true',
+                            help='recompute the activations of each layer in the backward pass '
+                                 'instead of storing them (default for encoders of {} or more '
+                                 'layers)'.format(_CHECKPOINT_MIN_LAYERS))
+        parser.add_argument('--no-checkpoint-activations', dest='checkpoint_activations',
+                            default=None, action='store_false',
+                            help='store the activations even for very deep encoders')
+        parser.add_argument('--bf16-autocast', default=False, action='store_true',
+                            help='run the forward pass under autocast with bfloat16, '
+                                 'and keep the decoder layers in bfloat16 for generation')
+        parser.add_argument('--torch-compile', default=False, action='store_true',
+                            help='compile the forward of each encoder and decoder layer and the '
+                                 'encoder layer history combination with torch.compile')
+        parser.add_argument('--torch-compile-mode', default='default',
+                            choices=['default', 'reduce-overhead', 'max-autotune'],
+                            help='torch.compile mode used with --torch-compile')
+        parser.add_argument('--tf32', default=False, action='store_true',
+                            help='allow TF32 tensor cores for fp32 matmuls and convolutions '
+                                 '(Ampere or newer GPUs)')
+        parser.add_argument('--fp8-kv-cache', default=False, action='store_true',
+                            help='store the decoder self-attention key/value cache in float8 '
+                                 'during incremental decoding')
+        parser.add_argument('--int8-ffn', default=False, action='store_true',
+                            help='quantize the weights of the decoder FFNs to int8 for generation')
+        parser.add_argument('--norm-type', choices=['layernorm', 'rmsnorm'],
+                            help='normalization used inside the layers and after the last layer; '
+                                 'rmsnorm checkpoints are not interchangeable with layernorm ones')
 
     @classmethod
     def build_model(cls, args, task):
@@ -127,6 +160,10 @@ class SdtTransformerModel(FairseqModel):
         # make sure all arguments are present in older models
         base_architecture(args)
 
+        if args.tf32:
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+
         if not hasattr(args, 'max_source_positions'):
             args.max_source_positions = 1024
         if not hasattr(args, 'max_target_positions'):
@@ -168,7 +205,45 @@ class SdtTransformerModel(FairseqModel):
 
         encoder = TransformerEncoder(args, src_dict, encoder_embed_tokens)
         decoder = TransformerDecoder(args, tgt_dict, decoder_embed_tokens)
-        return SdtTransformerModel(encoder, decoder)
+
+        if args.torch_compile:
+            # compile the bound forward rather than wrapping the module, so the
+            # parameter names (and thus checkpoints) are unchanged; sequence
+            # lengths vary between batches, hence dynamic shapes
+            for layer in list(encoder.layers) + list(decoder.layers):
+                layer.forward = torch.compile(layer.forward, dynamic=True, mode=args.torch_compile_mode)
+            # the dense history combination (stack, weighted sum and norm) runs
+            # between the layers; the training path still specializes on the
+            # number of stacked layers, so deep encoders may need a larger
+            # torch._dynamo.config.cache_size_limit
+            if encoder.history is not None:
+                encoder.history.pop = torch.compile(
+                    encoder.history.pop, dynamic=True, mode=args.torch_compile_mode,
+                )
+
+        return SdtTransformerModel(encoder, decoder, bf16_autocast=args.bf16_autocast)
+
+    def forward(self, src_tokens, src_lengths, prev_output_tokens):
+        with torch.autocast(device_type=src_tokens.device.type, dtype=torch.bfloat16, enabled=self.bf16_autocast):
+            x, extra = super().forward(src_tokens, src_lengths, prev_output_tokens)
+        if self.bf16_autocast:
+            # the criterion normalizes the logits outside of autocast
+            x = x.float()
+        return x, extra
+
+    def quantize_for_inference(self):
+        """Quantize the FFN and attention output projections to int8.
+
+        Uses dynamic quantization (int8 weights, activations quantized on the
+        fly), which runs on CPU. Embeddings and the output projection stay in
+        floating point to preserve the accuracy of the softmax.
+        """
+        names = {
+            name for name, module in self.named_modules()
+            if isinstance(module, nn.Linear) and name.rsplit('.', 1)[-1] in ('fc1', 'fc2', 'out_proj')
+        }
+        torch.ao.quantization.quantize_dynamic(self, names, dtype=torch.qint8, inplace=True)
+        return self
 
 
 class TransformerEncoder(FairseqEncoder):
@@ -188,11 +263,12 @@ class TransformerEncoder(FairseqEncoder):
         super().__init__(dictionary)
         self.dropout = args.dropout
         self.k = args.k
-        self.count = 0
-        #self.attn_weight = []
 
-        #self.Sigmoid = torch.nn.Sigmoid()
-        #self.alpha = nn.Parameter(torch.zeros(1))
+        # history schedule: pop the dense combination before the layers in k,
+        # push the output of the layer right below them
+        k = set(self.k)
+        self.pop_before = [i in k for i in range(args.encoder_layers)]
+        self.push_after = [i not in k and i + 1 in k for i in range(args.encoder_layers)]
 
         embed_dim = embed_tokens.embedding_dim
         self.padding_idx = embed_tokens.padding_idx
@@ -216,11 +292,8 @@ class TransformerEncoder(FairseqEncoder):
         self.register_buffer('version', torch.Tensor([2]))
         self.normalize = args.encoder_normalize_before
         if self.normalize:
-            self.layer_norm = LayerNorm(embed_dim)
-
-        self.inspected_grads = OrderedDict() if getattr(args, 'inspect_grad', False) else None
-        self.inspected_grads_qkv = OrderedDict() if getattr(args, 'inspect_grad', False) else None
-        self.inspected_grads_ffn_out = OrderedDict() if getattr(args, 'inspect_grad', False) else None
+            self.layer_norm = Normalization(args, embed_dim)
+        self.checkpoint_activations = getattr(args, 'checkpoint_activations', False)
 
     def forward(self, src_tokens, src_lengths):
         """
@@ -239,110 +312,52 @@ class TransformerEncoder(FairseqEncoder):
         """
         if self.history is not None:
             self.history.clean()
-        # embed tokens and positions
-        x = self.embed_scale * self.embed_tokens(src_tokens)
-        if self.embed_positions is not None:
-            x += self.embed_positions(src_tokens)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-
-        # B x T x C -> T x B x C
-        x = x.transpose(0, 1)
-        util.inspect_grad("encoder_0", x, self.inspected_grads)
-        #temp = x
+        # embed tokens and positions directly in T x B x C layout, so the
+        # layers get a contiguous input instead of a transposed view
+        x = scale_add_dropout(
+            self.embed_tokens(src_tokens.t()), self.embed_scale,
+            self.embed_positions(src_tokens).transpose(0, 1) if self.embed_positions is not None else None,
+            self.dropout, self.training,
+        )
 
         # add emb into history
         if self.history is not None:
             self.history.add(x)
 
-        # compute padding mask
+        # compute padding mask (always kept: testing whether it has any
+        # padding would force a device-to-host sync on every forward)
         encoder_padding_mask = src_tokens.eq(self.padding_idx)
-        if not encoder_padding_mask.any():
-            encoder_padding_mask = None
+
+        # convert the padding mask once into an additive bias shared by all layers
+        padding_bias = x.new_zeros(encoder_padding_mask.size()).masked_fill_(
+            encoder_padding_mask, float('-inf'),
+        )
 
         # encoder layers
-        #inner_states=[x]
         for layer_id, layer in enumerate(self.layers):
-            if layer_id in self.k:
-                if self.history is not None:
-                    x = self.history.pop()
-                x,qkv,ffn_out, attn_weight = layer(x, encoder_padding_mask)
-                #inner_states.append(x)
-                #self.attn_weight.append(attn_weight)
-                #util.inspect_grad("encoder_%d" % (layer_id+1), x, self.inspected_grads)
-                #util.inspect_grad("encoder_%d" % (layer_id + 1), qkv, self.inspected_grads_qkv)
-                #util.inspect_grad("encoder_%d" % (layer_id + 1), ffn_out, self.inspected_grads_ffn_out)
-            else:
-                x,qkv,ffn_out, attn_weight = layer(x, encoder_padding_mask)
-                #inner_states.append(x)
-                #self.attn_weight.append(attn_weight)
-                #util.inspect_grad("encoder_%d" % (layer_id+1), x, self.inspected_grads)
-                #util.inspect_grad("encoder_%d" % (layer_id + 1), qkv, self.inspected_grads_qkv)
-                #util.inspect_grad("encoder_%d" % (layer_id + 1), ffn_out, self.inspected_grads_ffn_out)
-                if layer_id + 1 in self.k:
-                    if self.history is not None:
-                        self.history.add(x)
-        #self.count = 0
-        #self.history.print_weight()
+            if self.history is not None and self.pop_before[layer_id]:
+                x = self.history.pop()
+            x = self.forward_layer(layer, x, padding_bias)
+            if self.history is not None and self.push_after[layer_id]:
+                self.history.add(x)
+
         if self.history is not None:
             x = self.history.pop()
 
         if self.normalize:
             x = self.layer_norm(x)
 
-        #util.inspect_grad("encoder_top", x, self.inspected_grads)
-        #输出分布
-        #self.print_attn_weight()
-        #for key,value in dict_intra_sim.items():
-            #print('{}'.format(value))
-
         return {
             'encoder_out': x,  # T x B x C
             'encoder_padding_mask': encoder_padding_mask,  # B x T
         }
 
-    def layer_sim(self,inner_states):
-        length, batch, hidden = inner_states[0].size()
-        if not self.training and batch ==1:
-            word_rep_list = inner_states[0].view(length, hidden)
-            word_sim = {}
-            cos = torch.nn.CosineSimilarity(dim=0, eps=1e-6)
-            for id, i in enumerate(inner_states[1:]):
-                layer_rep_list = i.view(length, hidden)
-                word_average = 0
-                for i in range(3, 4):
-                    cosin = cos(word_rep_list[i], layer_rep_list[i])
-                    word_average += cosin
-                # word_average = word_average / (length)
-                word_sim[id+1] = word_average
-        for key, value in word_sim.items():
-            # print(value)
-            print('{}'.format(value))
-    def adj_sim(self,inner_states):
-        length, batch, hidden = inner_states[0].size()
-        if not self.training and batch ==1:
-            word_rep_list = inner_states[0].view(length, hidden)
-            word_sim = {}
-            cos = torch.nn.CosineSimilarity(dim=0, eps=1e-6)
-            for id, i in enumerate(inner_states[1:]):
-                layer_rep_list = i.view(length, hidden)
-                word_average = 0
-                for i in range(3, 4):
-                    cosin = cos(word_rep_list[i], layer_rep_list[i])
-                    word_average += cosin
-                # word_average = word_average / (length)
-                word_sim[id+1] = word_average
-                word_rep_list = layer_rep_list
-        for key, value in word_sim.items():
-            # print(value)
-            print('{}'.format(value))
-
-    def print_attn_weight(self):
-        for layer_id, tensor in enumerate(self.attn_weight):
-            with open('attn_weight_stack', 'a') as f:
-                f.write(str(layer_id))
-                f.write('\n')
-                f.write(str(tensor.cpu().numpy()))
-                f.write('\n')
+    def forward_layer(self, layer, x, encoder_padding_mask):
+        """Run a single encoder layer, recomputing its activations in the
+        backward pass if *args.checkpoint_activations* is set."""
+        if self.checkpoint_activations and self.training:
+            return checkpoint(layer, x, encoder_padding_mask, use_reentrant=False)
+        return layer(x, encoder_padding_mask)
 
     def reorder_encoder_out(self, encoder_out, new_order):
         """
@@ -453,9 +468,21 @@ class TransformerDecoder(FairseqIncrementalDecoder):
         self.register_buffer('version', torch.Tensor([2]))
         self.normalize = args.decoder_normalize_before and final_norm
         if self.normalize:
-            self.layer_norm = LayerNorm(embed_dim)
-
-    def forward(self, prev_output_tokens, encoder_out=None, incremental_state=None):
+            self.layer_norm = Normalization(args, embed_dim)
+        self.checkpoint_activations = getattr(args, 'checkpoint_activations', False)
+        self.bf16_autocast = getattr(args, 'bf16_autocast', False)
+        self.int8_ffn = getattr(args, 'int8_ffn', False)
+        # dtype of the decoder layers when they were converted for generation
+        self.layer_dtype = None
+
+        # future mask for the longest supported target, built on first use
+        self.register_buffer('_future_mask', torch.empty(0), persistent=False)
+        # stacked encoder-attention key/value projections of all layers, built
+        # by make_generation_fast_
+        self.register_buffer('_encoder_kv_weight', None, persistent=False)
+        self.register_buffer('_encoder_kv_bias', None, persistent=False)
+
+    def forward(self, prev_output_tokens, encoder_out=None, incremental_state=None, return_all_hiddens=False):
         """
         Args:
             prev_output_tokens (LongTensor): previous decoder outputs of shape
@@ -464,6 +491,8 @@ class TransformerDecoder(FairseqIncrementalDecoder):
                 encoder-side attention
             incremental_state (dict): dictionary used for storing state during
                 :ref:`Incremental decoding`
+            return_all_hiddens (bool, optional): also return the output of
+                every layer as *inner_states* (default: False).
 
         Returns:
             tuple:
@@ -486,44 +515,84 @@ class TransformerDecoder(FairseqIncrementalDecoder):
             if positions is not None:
                 positions = positions[:, -1:]
 
-        # embed tokens and positions
-        x = self.embed_scale * self.embed_tokens(prev_output_tokens)
+        # embed tokens and positions directly in T x B x C layout
+        x = self.embed_tokens(prev_output_tokens.t())
 
+        # project_in_dim has no bias, so the embedding scale can be applied after it
         if self.project_in_dim is not None:
             x = self.project_in_dim(x)
 
-        if positions is not None:
-            x += positions
-        x = F.dropout(x, p=self.dropout, training=self.training)
-
-        # B x T x C -> T x B x C
-        x = x.transpose(0, 1)
+        x = scale_add_dropout(
+            x, self.embed_scale,
+            positions.transpose(0, 1) if positions is not None else None,
+            self.dropout, self.training,
+        )
         attn = None
 
-        inner_states = [x]
+        inner_states = [x] if return_all_hiddens else None
 
         # add emb into history
         #if self.history is not None:
             #self.history.add(x)
 
-        # decoder layers
-        for layer in self.layers:
+        input_dtype = x.dtype
+        if self.layer_dtype is not None:
+            x = x.to(self.layer_dtype)
+
+        enc, enc_padding_bias = None, None
+        if encoder_out is not None:
+            enc = encoder_out['encoder_out']
+            # Cross-attention keys/values are projected from encoder_out only
+            # on the first incremental step and then reused from
+            # incremental_state (static_kv), so enc is only converted to the
+            # layer dtype when the layers read it; the padding mask is
+            # converted once to an additive bias shared by every layer.
+            if (
+                (incremental_state is None or not self._project_encoder_kv(enc, incremental_state))
+                and self.layer_dtype is not None
+            ):
+                enc = enc.to(self.layer_dtype)
+            enc_padding_bias = encoder_out['encoder_padding_mask']
+            if enc_padding_bias is not None and not enc_padding_bias.is_floating_point():
+                enc_padding_bias = x.new_zeros(enc_padding_bias.size()).masked_fill_(
+                    enc_padding_bias, float('-inf'))
+
+        # decoder layers; only the attention of the last layer is returned, so
+        # the others don't materialize their attention weights
+        for idx, layer in enumerate(self.layers):
             #if self.history is not None:
                 #x = self.history.pop()
-            x, attn = layer(
-                x,
-                encoder_out['encoder_out'] if encoder_out is not None else None,
-                encoder_out['encoder_padding_mask'] if encoder_out is not None else None,
-                incremental_state,
-                self_attn_mask=self.buffered_future_mask(x) if incremental_state is None else None,
-            )
-            inner_states.append(x)
+            if self.checkpoint_activations and self.training and incremental_state is None:
+                x, attn = checkpoint(
+                    layer,
+                    x,
+                    enc,
+                    enc_padding_bias,
+                    None,  # incremental_state
+                    None,  # prev_self_attn_state
+                    None,  # prev_attn_state
+                    self.buffered_future_mask(x),
+                    use_reentrant=False,
+                )
+            else:
+                x, attn = layer(
+                    x,
+                    enc,
+                    enc_padding_bias,
+                    incremental_state,
+                    self_attn_mask=self.buffered_future_mask(x) if incremental_state is None else None,
+                    need_attn=(idx == len(self.layers) - 1),
+                )
+            if return_all_hiddens:
+                inner_states.append(x)
             #if self.history is not None:
                 #self.history.add(x)
 
         #if self.history is not None:
             #x = self.history.pop()
 
+        x = x.to(input_dtype)
+
         if self.normalize:
             x = self.layer_norm(x)
 
@@ -542,6 +611,65 @@ class TransformerDecoder(FairseqIncrementalDecoder):
 
         return x, {'attn': attn, 'inner_states': inner_states}
 
+    def _project_encoder_kv(self, enc, incremental_state):
+        """Fill the encoder-attention cache of every layer with one GEMM.
+
+        On the first incremental step the key/value weights of all layers are
+        stacked so that *enc* is read once instead of once per layer. Later
+        steps find the cache filled and return immediately. Returns whether
+        the cache is filled, i.e. the layers won't read *enc*.
+        """
+        attns = [layer.encoder_attn for layer in self.layers]
+        if len(attns) == 0 or attns[0] is None or attns[0].onnx_trace:
+            return False
+        if 'prev_key' in attns[0]._get_input_buffer(incremental_state):
+            return True
+        if self.layer_dtype is not None:
+            enc = enc.to(self.layer_dtype)
+        if self._encoder_kv_weight is not None:
+            weight, bias = self._encoder_kv_weight, self._encoder_kv_bias
+        else:
+            weight, bias = self._stack_encoder_kv_proj()
+        src_len, bsz, _ = enc.size()
+        kv = F.linear(enc, weight, bias).view(src_len, bsz, len(attns), 2, -1)
+        for i, attn in enumerate(attns):
+            # (src_len, bsz, embed_dim) -> (bsz, num_heads, src_len, head_dim)
+            k, v = (
+                kv[:, :, i, j].view(src_len, bsz, attn.num_heads, attn.head_dim)
+                .permute(1, 2, 0, 3).contiguous()
+                for j in range(2)
+            )
+            attn._set_input_buffer(incremental_state, {'prev_key': k, 'prev_value': v})
+        return True
+
+    def _stack_encoder_kv_proj(self):
+        """Concatenate the key/value projections of every encoder attention."""
+        attns = [layer.encoder_attn for layer in self.layers]
+        embed_dim = attns[0].embed_dim
+        weight = torch.cat([attn.in_proj_weight[embed_dim:] for attn in attns], dim=0)
+        bias = None
+        if attns[0].in_proj_bias is not None:
+            bias = torch.cat([attn.in_proj_bias[embed_dim:] for attn in attns], dim=0)
+        return weight, bias
+
+    def make_generation_fast_(self, **kwargs):
+        if self.int8_ffn:
+            # quantize from the full precision weights
+            for layer in self.layers:
+                layer.quantize_ffn_()
+        # generation calls the decoder directly rather than through the
+        # autocast region of SdtTransformerModel.forward; with --bf16-autocast
+        # store the layers in bfloat16 instead, which also halves the
+        # incremental key/value buffers
+        if self.bf16_autocast and self.layer_dtype is None:
+            self.layers.to(torch.bfloat16)
+            self.layer_dtype = torch.bfloat16
+        # the weights are frozen from here on, so the stacked projection of
+        # _project_encoder_kv is built once instead of for every batch
+        if len(self.layers) > 0 and self.layers[0].encoder_attn is not None:
+            with torch.no_grad():
+                self._encoder_kv_weight, self._encoder_kv_bias = self._stack_encoder_kv_proj()
+
     def max_positions(self):
         """Maximum output length supported by the decoder."""
         if self.embed_positions is None:
@@ -550,10 +678,12 @@ class TransformerDecoder(FairseqIncrementalDecoder):
 
     def buffered_future_mask(self, tensor):
         dim = tensor.size(0)
-        if not hasattr(self, '_future_mask') or self._future_mask is None or self._future_mask.device != tensor.device:
-            self._future_mask = torch.triu(utils.fill_with_neg_inf(tensor.new(dim, dim)), 1)
         if self._future_mask.size(0) < dim:
-            self._future_mask = torch.triu(utils.fill_with_neg_inf(self._future_mask.resize_(dim, dim)), 1)
+            # build directly on the device and in the dtype of the activations
+            size = max(dim, self.max_target_positions)
+            self._future_mask = torch.triu(utils.fill_with_neg_inf(tensor.new(size, size)), 1)
+        elif self._future_mask.device != tensor.device or self._future_mask.dtype != tensor.dtype:
+            self._future_mask = self._future_mask.to(device=tensor.device, dtype=tensor.dtype)
         return self._future_mask[:dim, :dim]
 
     def upgrade_state_dict_named(self, state_dict, name):
@@ -620,43 +750,40 @@ class TransformerEncoderLayer(nn.Module):
         self.normalize_before = args.encoder_normalize_before
         self.fc1 = Linear(self.embed_dim, args.encoder_ffn_embed_dim)
         self.fc2 = Linear(args.encoder_ffn_embed_dim, self.embed_dim)
-        self.layer_norms = nn.ModuleList([LayerNorm(self.embed_dim) for i in range(2)])
+        self.layer_norms = nn.ModuleList([Normalization(args, self.embed_dim) for i in range(2)])
 
     def forward(self, x, encoder_padding_mask):
         """
         Args:
             x (Tensor): input to the layer of shape `(seq_len, batch, embed_dim)`
             encoder_padding_mask (ByteTensor): binary ByteTensor of shape
-                `(batch, src_len)` where padding elements are indicated by ``1``.
+                `(batch, src_len)` where padding elements are indicated by ``1``,
+                or the equivalent additive float mask.
 
         Returns:
             encoded output of shape `(batch, src_len, embed_dim)`
         """
         residual = x
-        x = self.maybe_layer_norm(0, x, before=True)
-        x, attn_weight = self.self_attn(query=x, key=x, value=x, key_padding_mask=encoder_padding_mask)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        qkv = x
-        x = residual + x
-        x = self.maybe_layer_norm(0, x, after=True)
+        if self.normalize_before:
+            x = self.layer_norms[0](x)
+        x, _ = self.self_attn(
+            query=x, key=x, value=x,
+            key_padding_mask=encoder_padding_mask,
+            need_weights=False,
+        )
+        x = dropout_add(x, residual, self.dropout, self.training)
+        if not self.normalize_before:
+            x = self.layer_norms[0](x)
 
         residual = x
-        x = self.maybe_layer_norm(1, x, before=True)
-        x = F.relu(self.fc1(x))
-        x = F.dropout(x, p=self.relu_dropout, training=self.training)
+        if self.normalize_before:
+            x = self.layer_norms[1](x)
+        x = linear_relu_dropout(self.fc1, x, self.relu_dropout, self.training)
         x = self.fc2(x)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        ffn_out = x
-        x = residual + x
-        x = self.maybe_layer_norm(1, x, after=True)
-        return x,qkv,ffn_out,attn_weight
-
-    def maybe_layer_norm(self, i, x, before=False, after=False):
-        assert before ^ after
-        if after ^ self.normalize_before:
-            return self.layer_norms[i](x)
-        else:
-            return x
+        x = dropout_add(x, residual, self.dropout, self.training)
+        if not self.normalize_before:
+            x = self.layer_norms[1](x)
+        return x
 
 
 class TransformerDecoderLayer(nn.Module):
@@ -693,8 +820,9 @@ class TransformerDecoderLayer(nn.Module):
         self.dropout = args.dropout
         self.relu_dropout = args.relu_dropout
         self.normalize_before = args.decoder_normalize_before
+        self.self_attn.fp8_kv_cache = getattr(args, 'fp8_kv_cache', False) and HAS_FP8
 
-        self.self_attn_layer_norm = LayerNorm(self.embed_dim)
+        self.self_attn_layer_norm = Normalization(args, self.embed_dim)
 
         if no_encoder_attn:
             self.encoder_attn = None
@@ -704,33 +832,40 @@ class TransformerDecoderLayer(nn.Module):
                 self.embed_dim, args.decoder_attention_heads,
                 dropout=args.attention_dropout,
             )
-            self.encoder_attn_layer_norm = LayerNorm(self.embed_dim)
+            self.encoder_attn_layer_norm = Normalization(args, self.embed_dim)
 
         self.fc1 = Linear(self.embed_dim, args.decoder_ffn_embed_dim)
         self.fc2 = Linear(args.decoder_ffn_embed_dim, self.embed_dim)
 
-        self.final_layer_norm = LayerNorm(self.embed_dim)
+        self.final_layer_norm = Normalization(args, self.embed_dim)
         self.need_attn = True
 
         self.onnx_trace = False
 
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
+        # keep the regular forward free of the tracing-only return value
+        self.forward = self._forward_onnx
 
     def forward(self, x, encoder_out, encoder_padding_mask, incremental_state,
                 prev_self_attn_state=None, prev_attn_state=None, self_attn_mask=None,
-                self_attn_padding_mask=None):
+                self_attn_padding_mask=None, need_attn=True):
         """
         Args:
             x (Tensor): input to the layer of shape `(seq_len, batch, embed_dim)`
             encoder_padding_mask (ByteTensor): binary ByteTensor of shape
-                `(batch, src_len)` where padding elements are indicated by ``1``.
+                `(batch, src_len)` where padding elements are indicated by ``1``,
+                or the equivalent additive float mask.
+            need_attn (bool, optional): return the encoder attention weights.
+                Without them the fused attention kernel can be used
+                (default: True).
 
         Returns:
             encoded output of shape `(batch, src_len, embed_dim)`
         """
         residual = x
-        x = self.maybe_layer_norm(self.self_attn_layer_norm, x, before=True)
+        if self.normalize_before:
+            x = self.self_attn_layer_norm(x)
         if prev_self_attn_state is not None:
             if incremental_state is None:
                 incremental_state = {}
@@ -745,15 +880,18 @@ class TransformerDecoderLayer(nn.Module):
             incremental_state=incremental_state,
             need_weights=False,
             attn_mask=self_attn_mask,
+            # outside of incremental decoding the mask is the future mask
+            is_causal=(self_attn_mask is not None and incremental_state is None),
         )
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(self.self_attn_layer_norm, x, after=True)
+        x = dropout_add(x, residual, self.dropout, self.training)
+        if not self.normalize_before:
+            x = self.self_attn_layer_norm(x)
 
         attn = None
         if self.encoder_attn is not None:
             residual = x
-            x = self.maybe_layer_norm(self.encoder_attn_layer_norm, x, before=True)
+            if self.normalize_before:
+                x = self.encoder_attn_layer_norm(x)
             if prev_attn_state is not None:
                 if incremental_state is None:
                     incremental_state = {}
@@ -767,36 +905,52 @@ class TransformerDecoderLayer(nn.Module):
                 key_padding_mask=encoder_padding_mask,
                 incremental_state=incremental_state,
                 static_kv=True,
-                need_weights=(not self.training and self.need_attn),
+                need_weights=(not self.training and self.need_attn and need_attn),
             )
-            x = F.dropout(x, p=self.dropout, training=self.training)
-            x = residual + x
-            x = self.maybe_layer_norm(self.encoder_attn_layer_norm, x, after=True)
+            x = dropout_add(x, residual, self.dropout, self.training)
+            if not self.normalize_before:
+                x = self.encoder_attn_layer_norm(x)
 
         residual = x
-        x = self.maybe_layer_norm(self.final_layer_norm, x, before=True)
-        x = F.relu(self.fc1(x))
-        x = F.dropout(x, p=self.relu_dropout, training=self.training)
+        if self.normalize_before:
+            x = self.final_layer_norm(x)
+        x = linear_relu_dropout(self.fc1, x, self.relu_dropout, self.training)
         x = self.fc2(x)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(self.final_layer_norm, x, after=True)
-        if self.onnx_trace:
-            saved_state = self.self_attn._get_input_buffer(incremental_state)
-            self_attn_state = saved_state["prev_key"], saved_state["prev_value"]
-            return x, attn, self_attn_state
+        x = dropout_add(x, residual, self.dropout, self.training)
+        if not self.normalize_before:
+            x = self.final_layer_norm(x)
         return x, attn
 
-    def maybe_layer_norm(self, layer_norm, x, before=False, after=False):
-        assert before ^ after
-        if after ^ self.normalize_before:
-            return layer_norm(x)
-        else:
-            return x
+    def _forward_onnx(self, x, encoder_out, encoder_padding_mask, incremental_state,
+                      prev_self_attn_state=None, prev_attn_state=None, self_attn_mask=None,
+                      self_attn_padding_mask=None, need_attn=True):
+        """Like :func:`forward`, but also returns the self-attention state so
+        that it can be threaded through an ONNX graph."""
+        if incremental_state is None and (prev_self_attn_state is not None or prev_attn_state is not None):
+            incremental_state = {}
+        x, attn = TransformerDecoderLayer.forward(
+            self, x, encoder_out, encoder_padding_mask, incremental_state,
+            prev_self_attn_state, prev_attn_state, self_attn_mask,
+            self_attn_padding_mask, need_attn,
+        )
+        saved_state = self.self_attn._get_input_buffer(incremental_state)
+        self_attn_state = saved_state["prev_key"], saved_state["prev_value"]
+        return x, attn, self_attn_state
 
     def make_generation_fast_(self, need_attn=False, **kwargs):
         self.need_attn = need_attn
 
+    def quantize_ffn_(self):
+        """Replace fc1 and fc2 by :class:`Int8Linear` for inference.
+
+        The FFN weights dominate the memory traffic of a decoding step;
+        attention projections are left in floating point.
+        """
+        if isinstance(self.fc1, Int8Linear):
+            return
+        self.fc1 = Int8Linear.from_float(self.fc1)
+        self.fc2 = Int8Linear.from_float(self.fc2)
+
 
 def Embedding(num_embeddings, embedding_dim, padding_idx):
     m = nn.Embedding(num_embeddings, embedding_dim, padding_idx=padding_idx)
@@ -805,6 +959,12 @@ def Embedding(num_embeddings, embedding_dim, padding_idx):
     return m
 
 
+def Normalization(args, embed_dim):
+    if getattr(args, 'norm_type', 'layernorm') == 'rmsnorm':
+        return RMSNorm(embed_dim)
+    return LayerNorm(embed_dim)
+
+
 def Linear(in_features, out_features, bias=True):
     m = nn.Linear(in_features, out_features, bias)
     nn.init.xavier_uniform_(m.weight)
@@ -855,6 +1015,16 @@ def base_architecture(args):
     args.max_relative_length = getattr(args, 'max_relative_length', args.max_relative_length)
     args.k_only = getattr(args, 'k_only', args.k_only)
     args.inspect_grad = getattr(args, 'inspect_grad', False)
+    if getattr(args, 'checkpoint_activations', None) is None:
+        args.checkpoint_activations = False
+    args.bf16_autocast = getattr(args, 'bf16_autocast', False)
+    args.torch_compile = getattr(args, 'torch_compile', False)
+    args.torch_compile_mode = getattr(args, 'torch_compile_mode', 'default')
+    args.tf32 = getattr(args, 'tf32', False)
+    args.norm_type = getattr(args, 'norm_type', 'layernorm')
+    args.fp8_kv_cache = getattr(args, 'fp8_kv_cache', False)
+    args.int8_ffn = getattr(args, 'int8_ffn', False)
+    args.history_softmax_weight = getattr(args, 'history_softmax_weight', False)
 
 @register_model_architecture('sdt_transformer', 'sdt_transformer_wmt_en_de')
 def transformer_wmt_en_de(args):
@@ -903,7 +1073,7 @@ def transformer_vaswani_wmt_en_de_big(args):
     base_architecture(args)
 
 
-@register_model_architecture('fusion_transformer', 'sdt_transformer_vaswani_wmt_en_fr_big')
+@register_model_architecture('sdt_transformer', 'sdt_transformer_vaswani_wmt_en_fr_big')
 def transformer_vaswani_wmt_en_fr_big(args):
     args.dropout = getattr(args, 'dropout', 0.1)
     transformer_vaswani_wmt_en_de_big(args)
@@ -925,217 +1095,60 @@ def transformer_wmt_en_de_big_t2t(args):
     transformer_vaswani_wmt_en_de_big(args)
 
 
+# encoder depth -> layers after which the dense history is aggregated (args.k),
+# and whether encoder/decoder self-attention uses relative positions
+_SDT_T2T_WMT_EN_DE_VARIANTS = [
+    (6, [0, 6], True),
+    (8, [0, 8], True),
+    (9, [0, 9], True),
+    (12, [0, 6, 12], True),
+    (15, [0, 6, 9, 12, 15], True),
+    (16, [0, 8, 16], True),
+    (18, [0, 6, 12, 18], True),
+    (21, [0, 6, 12, 21], True),
+    (24, [0, 6, 12, 18, 24], True),
+    (27, [0, 9, 18, 27], True),
+    (30, [0, 6, 12, 18, 24, 30], True),
+    (33, [0, 6, 12, 21, 33], True),
+    (36, [0, 6, 12, 18, 24, 30, 36], True),
+    (39, [0, 6, 9, 12, 15, 18, 21, 24, 27, 30, 33, 36, 39], True),
+    (42, [0, 6, 12, 18, 24, 30, 36, 42], True),
+    (45, [0, 6, 9, 12, 15, 18, 21, 24, 27, 30, 33, 36, 39, 42, 45], True),
+    (48, [0, 6, 12, 18, 24, 30, 36, 42, 48], True),
+    (54, [0, 6, 12, 18, 24, 30, 36, 42, 48, 54], True),
+    (60, [0, 6, 12, 18, 24, 30, 36, 42, 48, 54, 60], True),
+    (63, [0, 9, 18, 27, 36, 45, 54, 63], False),
+    (66, [0, 6, 12, 18, 24, 30, 36, 42, 48, 54, 60, 66], True),
+    (72, [0, 6, 12, 18, 24, 30, 36, 42, 48, 54, 60, 66, 72], True),
+    (96, [0, 6, 12, 18, 24, 30, 36, 42, 48, 96], False),
+]
+
+
+def _register_sdt_t2t_wmt_en_de(layers, k, relative):
+    def architecture(args):
+        args.encoder_normalize_before = True
+        args.decoder_normalize_before = True
+        args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
+        args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
+        args.encoder_layers = getattr(args, 'encoder_layers', layers)
+        args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
+        args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
+        args.k = list(k)
+        if getattr(args, 'checkpoint_activations', None) is None:
+            args.checkpoint_activations = layers >= _CHECKPOINT_MIN_LAYERS
+        if relative:
+            args.max_relative_length = 8
+            args.k_only = True
+        base_architecture(args)
 
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_6l')
-def transformer_t2t_wmt_en_de_6l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 6)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,6]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_8l')
-def transformer_t2t_wmt_en_de_8l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 8)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,8]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_9l')
-def transformer_t2t_wmt_en_de_9l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 9)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,9]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_12l')
-def transformer_t2t_wmt_en_de_12l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 12)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_15l')
-def transformer_t2t_wmt_en_de_15l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 15)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,9,12,15]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_16l')
-def transformer_t2t_wmt_en_de_16l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 16)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,8,16]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_18l')
-def transformer_t2t_wmt_en_de_18l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 18)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_21l')
-def transformer_t2t_wmt_en_de_21l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 21)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,21]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_24l')
-def transformer_t2t_wmt_en_de_24l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 24)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_27l')
-def transformer_t2t_wmt_en_de_27l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 27)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,9,18,27]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_30l')
-def transformer_t2t_wmt_en_de_30l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 30)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24,30]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_33l')
-def transformer_t2t_wmt_en_de_33l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 33)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,21,33]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
+    name = 'sdt_transformer_t2t_wmt_en_de_{}l'.format(layers)
+    architecture.__name__ = 'transformer_t2t_wmt_en_de_{}l'.format(layers)
+    register_model_architecture('sdt_transformer', name)(architecture)
 
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_36l')
-def transformer_t2t_wmt_en_de_36l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 36)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24,30,36]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
 
+for _layers, _k, _relative in _SDT_T2T_WMT_EN_DE_VARIANTS:
+    _register_sdt_t2t_wmt_en_de(_layers, _k, _relative)
 
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_39l')
-def transformer_t2t_wmt_en_de_39l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 39)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,9,12,15,18,21,24,27,30,33,36,39]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
 
 @register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_40l')
 def transformer_t2t_wmt_en_de_40l(args):
@@ -1145,133 +1158,3 @@ def transformer_t2t_wmt_en_de_40l(args):
     args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
     args.encoder_layers = getattr(args, 'encoder_layers', 40)
     base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_42l')
-def transformer_t2t_wmt_en_de_42l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 42)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24,30,36,42]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_45l')
-def transformer_t2t_wmt_en_de_45l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 45)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,9,12,15,18,21,24,27,30,33,36,39,42,45]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_48l')
-def transformer_t2t_wmt_en_de_48l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 48)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24,30,36,42,48]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_54l')
-def transformer_t2t_wmt_en_de_54l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 54)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,6,12,18,24,30,36,42,48,54]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_60l')
-def transformer_t2t_wmt_en_de_60l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 60)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,6,12,18,24,30,36,42,48,54,60]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_63l')
-def transformer_t2t_wmt_en_de_63l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 63)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,9,18,27,36,45,54,63]
-    #args.max_relative_length = 8
-    #args.k_only = True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_66l')
-def transformer_t2t_wmt_en_de_66l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 66)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,6,12,18,24,30,36,42,48,54,60,66]
-    args.max_relative_length = 8
-    args.k_only = True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_72l')
-def transformer_t2t_wmt_en_de_72l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 72)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k=[0,6,12,18,24,30,36,42,48,54,60,66,72]
-    args.max_relative_length = 8
-    args.k_only = True
-    args.inspect_grad=True
-    base_architecture(args)
-
-@register_model_architecture('sdt_transformer', 'sdt_transformer_t2t_wmt_en_de_96l')
-def transformer_t2t_wmt_en_de_96l(args):
-    args.encoder_normalize_before = True
-    args.decoder_normalize_before = True
-    args.attention_dropout = getattr(args, 'attention_dropout', 0.1)
-    args.relu_dropout = getattr(args, 'relu_dropout', 0.1)
-    args.encoder_layers = getattr(args, 'encoder_layers', 96)
-    args.encoder_history_type = getattr(args, 'encoder_history_type', 'learnable_dense')
-    args.decoder_history_type = getattr(args, 'decoder_history_type', 'learnable_dense')
-    args.k = [0,6,12,18,24,30,36,42,48,96]
-    base_architecture(args)
\ No newline at end of file
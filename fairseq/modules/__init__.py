@@ -12,8 +12,10 @@ from .character_token_embedder import CharacterTokenEmbedder
 from .conv_tbc import ConvTBC
 from .downsampled_multihead_attention import DownsampledMultiHeadAttention
 from .dynamic_convolution import DynamicConv1dTBC
+from .fused_ops import dropout_add, linear_relu_dropout, relu_dropout, scale_add_dropout
 from .grad_multiply import GradMultiply
 from .highway import Highway
+from .int8_linear import Int8Linear
 from .layer_norm import LayerNorm
 from .learned_positional_embedding import LearnedPositionalEmbedding
 from .lightweight_convolution import LightweightConv1dTBC
@@ -21,6 +23,7 @@ from .linearized_convolution import LinearizedConvolution
 from .logsumexp_moe import LogSumExpMoE
 from .mean_pool_gating_network import MeanPoolGatingNetwork
 from .multihead_attention import MultiheadAttention
+from .rms_norm import RMSNorm
 from .scalar_bias import ScalarBias
 from .sinusoidal_positional_embedding import SinusoidalPositionalEmbedding
 from .unfold1d import unfold1d
@@ -34,8 +37,10 @@ __all__ = [
     'ConvTBC',
     'DownsampledMultiHeadAttention',
     'DynamicConv1dTBC',
+    'dropout_add',
     'GradMultiply',
     'Highway',
+    'Int8Linear',
     'LayerNorm',
     'LearnedPositionalEmbedding',
     'LightweightConv1dTBC',
@@ -43,7 +48,11 @@ __all__ = [
     'LogSumExpMoE',
     'MeanPoolGatingNetwork',
     'MultiheadAttention',
+    'RMSNorm',
+    'linear_relu_dropout',
+    'relu_dropout',
     'ScalarBias',
+    'scale_add_dropout',
     'SinusoidalPositionalEmbedding',
     'unfold1d',
     'RelativeMultiheadAttention',
@@ -0,0 +1,50 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+"""
+float8 storage for the self-attention key/value cache of incremental decoding.
+"""
+
+import torch
+
+HAS_FP8 = hasattr(torch, 'float8_e4m3fn')
+_FP8_E4M3_MAX = 448.
+
+
+def quantize_fp8(x):
+    """Quantize *x* to float8 (e4m3) with one scale per vector along the last
+    dimension. The result is returned as a uint8 view so that indexing ops
+    used by beam search (index_select, cat) work on any device."""
+    scale = x.abs().amax(dim=-1, keepdim=True).float().clamp(min=1e-12) / _FP8_E4M3_MAX
+    q = (x.float() / scale).to(torch.float8_e4m3fn)
+    return q.view(torch.uint8), scale
+
+
+def dequantize_fp8(q, scale, dtype):
+    return (q.view(torch.float8_e4m3fn).float() * scale).to(dtype)
+
+
+def append_fp8_kv(saved_state, k, v, bsz, num_heads):
+    """Append the keys/values *k* and *v* of the new steps, of shape
+    `(bsz * num_heads, tgt_len, head_dim)`, to the fp8 cache in *saved_state*.
+
+    Only the new steps are quantized; the cached steps are dequantized on
+    read and never written back. Returns the keys and values of all steps.
+    """
+    out = []
+    for name, new in (('prev_key', k), ('prev_value', v)):
+        head_dim = new.size(-1)
+        q, scale = quantize_fp8(new.reshape(bsz, num_heads, -1, head_dim))
+        if name + '_fp8' in saved_state:
+            prev_q, prev_scale = saved_state[name + '_fp8'], saved_state[name + '_scale']
+            prev = dequantize_fp8(prev_q, prev_scale, new.dtype)
+            new = torch.cat((prev.view(bsz * num_heads, -1, head_dim), new), dim=1)
+            q = torch.cat((prev_q, q), dim=2)
+            scale = torch.cat((prev_scale, scale), dim=2)
+        saved_state[name + '_fp8'] = q
+        saved_state[name + '_scale'] = scale
+        out.append(new)
+    return out
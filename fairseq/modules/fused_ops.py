@@ -0,0 +1,68 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+"""
+Element-wise helpers shared by the transformer layers. Each helper is a short
+chain of memory-bound ops. They are plain Python functions, so that layers
+using them can be recomputed under :func:`torch.utils.checkpoint.checkpoint`;
+with ``--torch-compile`` Inductor fuses each chain into a single kernel.
+"""
+
+from typing import Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+_HAS_ADDMM_ACTIVATION = hasattr(torch, '_addmm_activation')
+
+
+def dropout_add(x, residual, p: float, training: bool):
+    """``residual + dropout(x)`` in one pass over *x*."""
+    return residual + F.dropout(x, p=p, training=training)
+
+
+def scale_add_dropout(x, scale: float, y: Optional[torch.Tensor], p: float, training: bool):
+    """``dropout(scale * x + y)`` in one pass over *x*; *y* may be ``None``."""
+    x = x * scale
+    if y is not None:
+        x = x + y
+    return F.dropout(x, p=p, training=training)
+
+
+def relu_dropout(x, p: float, training: bool):
+    """``dropout(relu(x))`` in one pass over *x*."""
+    return F.dropout(F.relu(x), p=p, training=training)
+
+
+def linear_relu_dropout(linear, x, p: float, training: bool):
+    """``dropout(relu(linear(x)))``.
+
+    At inference the bias add and ReLU are folded into the GEMM epilogue
+    (cuBLASLt on CUDA), so no element-wise kernel follows the matmul. The
+    epilogue op has no autograd support, so training and grad-enabled calls
+    fall back to :func:`relu_dropout`, as do calls under autocast, which
+    does not cast the inputs of the epilogue op. *linear* may also be a
+    dynamically quantized Linear, which is always called as is.
+    """
+    if (
+        _HAS_ADDMM_ACTIVATION and not training and not torch.is_grad_enabled()
+        and isinstance(linear, nn.Linear) and linear.bias is not None
+        and not _is_autocast_enabled(x)
+    ):
+        out = torch._addmm_activation(linear.bias, x.reshape(-1, x.size(-1)), linear.weight.t())
+        return out.view(x.size()[:-1] + (linear.out_features,))
+    return relu_dropout(linear(x), p, training)
+
+
+def _is_autocast_enabled(x):
+    try:
+        return torch.is_autocast_enabled(x.device.type)
+    except TypeError:
+        # torch < 2.4 only takes the device type as a separate query
+        if x.device.type == 'cpu':
+            return torch.is_autocast_cpu_enabled()
+        return torch.is_autocast_enabled()
@@ -0,0 +1,81 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+_HAS_INT8PACK_MM = hasattr(torch, '_weight_int8pack_mm')
+# (device type, dtype) pairs the int8 weight-only kernel has rejected
+_INT8PACK_MM_UNSUPPORTED = set()
+
+
+class Int8Linear(nn.Module):
+    """Linear layer with int8 weights and floating point activations.
+
+    Weights are quantized symmetrically per output channel. Where available
+    the int8 weight-only GEMM (``torch._weight_int8pack_mm``) reads the int8
+    weight directly and applies the scale in the kernel. Otherwise the weight
+    is cast to the activation dtype and the scale and bias are applied to the
+    GEMM output in one op.
+    """
+
+    def __init__(self, in_features, out_features, bias=True):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer('weight', torch.zeros(out_features, in_features, dtype=torch.int8))
+        self.register_buffer('scale', torch.ones(out_features))
+        if bias:
+            self.register_buffer('bias', torch.zeros(out_features))
+        else:
+            self.bias = None
+
+    @classmethod
+    def from_float(cls, linear):
+        """Quantize the weight of the :class:`torch.nn.Linear` *linear*."""
+        m = cls(linear.in_features, linear.out_features, bias=linear.bias is not None)
+        weight = linear.weight.detach().float()
+        scale = weight.abs().max(dim=1)[0].clamp(min=1e-8) / 127.
+        m.weight = torch.round(weight / scale.unsqueeze(1)).clamp(-127, 127).to(torch.int8)
+        m.scale = scale.to(linear.weight.dtype)
+        if linear.bias is not None:
+            m.bias = linear.bias.detach().clone()
+        return m
+
+    def forward(self, x):
+        if self._use_int8pack_mm(x):
+            try:
+                out = torch._weight_int8pack_mm(
+                    x.reshape(-1, self.in_features).contiguous(), self.weight, self.scale.to(x.dtype),
+                )
+            except (RuntimeError, NotImplementedError):
+                _INT8PACK_MM_UNSUPPORTED.add((x.device.type, x.dtype))
+            else:
+                out = out.view(*x.shape[:-1], self.out_features)
+                if self.bias is not None:
+                    out = out + self.bias.to(x.dtype)
+                return out
+        out = F.linear(x, self.weight.to(x.dtype))
+        if self.bias is not None:
+            return torch.addcmul(self.bias.to(x.dtype), out, self.scale.to(x.dtype))
+        return out * self.scale.to(x.dtype)
+
+    @staticmethod
+    def _use_int8pack_mm(x):
+        # the kernel has no backward
+        return (
+            _HAS_INT8PACK_MM
+            and not (torch.is_grad_enabled() and x.requires_grad)
+            and (x.device.type, x.dtype) not in _INT8PACK_MM_UNSUPPORTED
+        )
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}, bias={}'.format(
+            self.in_features, self.out_features, self.bias is not None,
+        )
@@ -1,10 +1,8 @@
 import torch
 import torch.nn as nn
-from fairseq.models.transformer import LayerNorm
-import queue
-import fairseq.utils as utils
 import torch.nn.functional as F
-import numpy as np
+
+from fairseq.modules.rms_norm import rms_norm
 
 
 def CreateLayerHistory(args, is_encoder):
@@ -28,7 +26,33 @@ class BaseLayerHistory(nn.Module):
         # layers = args.encoder_layers if is_encoder else args.decoder_layers
         layers = len(args.k) - 1 if is_encoder else args.decoder_layers
         dim = args.encoder_embed_dim if is_encoder else args.decoder_embed_dim
-        self.layer_norms = nn.ModuleList(LayerNorm(dim) for _ in range(layers))
+        # the per-layer norms share one (layers, dim) weight (and bias) tensor
+        # instead of a ModuleList, so they are a single parameter each for the
+        # optimizer and in checkpoints
+        self.norm_layers = layers
+        self.normalized_shape = (dim,)
+        self.rms_norm = getattr(args, 'norm_type', 'layernorm') == 'rmsnorm'
+        self.norm_eps = 1e-6 if self.rms_norm else 1e-5
+        self.norm_weight = nn.Parameter(torch.ones(layers, dim))
+        if self.rms_norm:
+            self.register_parameter('norm_bias', None)
+        else:
+            self.norm_bias = nn.Parameter(torch.zeros(layers, dim))
+
+    def layer_norm(self, x, idx):
+        if self.rms_norm:
+            return rms_norm(x, self.normalized_shape, self.norm_weight[idx], self.norm_eps)
+        return F.layer_norm(
+            x, self.normalized_shape, self.norm_weight[idx], self.norm_bias[idx], self.norm_eps,
+        )
+
+    def upgrade_state_dict_named(self, state_dict, name):
+        """Stack the weights of the old per-layer ``layer_norms`` modules."""
+        for m in ('weight', 'bias'):
+            keys = ['{}.layer_norms.{}.{}'.format(name, i, m) for i in range(self.norm_layers)]
+            if keys and all(k in state_dict for k in keys):
+                state_dict['{}.norm_{}'.format(name, m)] = torch.stack([state_dict.pop(k) for k in keys])
+        return state_dict
 
     def add(self, layer):
         raise NotImplemented
@@ -49,10 +73,20 @@ class LearnableDenseLayerHistory(BaseLayerHistory):
         super(LearnableDenseLayerHistory, self).__init__(args, is_encoder)
         self.sum = None
         self.count = 0
+        self.buffer = None
+        self.storage = None
+        self.weight_table = None
         # self.layer_num = 1 + (args.encoder_layers if is_encoder else args.decoder_layers)
         self.layer_num = len(args.k) if is_encoder else args.decoder_layers + 1
-        self.weight = nn.Parameter(torch.Tensor(self.layer_num, self.layer_num).fill_(1.0).tril())
-        self.weight.data = self.weight.data / self.weight.data.sum(1, keepdim=True)
+        self.layers = [None] * self.layer_num
+        self.softmax_weight = getattr(args, 'history_softmax_weight', False)
+        if self.softmax_weight:
+            # rows are normalized by a softmax over the visible layers in pop(),
+            # so zeros start out as the same uniform average
+            self.weight = nn.Parameter(torch.zeros(self.layer_num, self.layer_num))
+        else:
+            self.weight = nn.Parameter(torch.Tensor(self.layer_num, self.layer_num).fill_(1.0).tril())
+            self.weight.data = self.weight.data / self.weight.data.sum(1, keepdim=True)
 
         # print('count:', len(list(self.named_parameters())))
         # for k,v in self.named_parameters():
@@ -67,32 +101,87 @@ class LearnableDenseLayerHistory(BaseLayerHistory):
         # first layer
         if self.sum is None:
             self.sum = layer
-            self.layers.append(layer)
-            return
-
         # following layer
-        if self.normalize_before:
-            layer = self.layer_norms[self.count - 2](layer)
+        elif self.normalize_before:
+            layer = self.layer_norm(layer, self.count - 2)
 
-        self.layers.append(layer)
+        if torch.is_grad_enabled():
+            self.layers[self.count - 1] = layer
+            return
+
+        # without autograd the layers can be written in place into one buffer,
+        # so pop() does not have to stack all previous layers again. The flat
+        # storage behind it outlives clean() and only grows, so later batches
+        # of the same or smaller size reuse it without a new allocation.
+        if self.count == 1:
+            self.buffer = self._get_buffer(layer)
+        self.buffer[self.count - 1].copy_(layer)
+
+    def _get_buffer(self, layer):
+        numel = self.layer_num * layer.numel()
+        if (
+            self.storage is None
+            or self.storage.numel() < numel
+            or self.storage.dtype != layer.dtype
+            or self.storage.device != layer.device
+        ):
+            self.storage = layer.new_empty(numel)
+        return self.storage[:numel].view((self.layer_num,) + layer.size())
 
     def pop(self):
-        assert len(self.layers) > 0
+        assert self.count > 0
         # print(self.weight)
         # layers_dropout = F.dropout(torch.stack(self.layers, 0), p=self.dense_dropout, training=self.training)
         # ret = (layers_dropout * self.weight[self.count -1, : self.count].view(-1, 1, 1, 1)).sum(0)
-        ret = (torch.stack(self.layers, 0) * self.weight[self.count - 1, : self.count].view(-1, 1, 1, 1)).sum(0)
+        if self.layers[self.count - 1] is not None:
+            layers = torch.stack(self.layers[:self.count], 0)
+        else:
+            layers = self.buffer[:self.count]
+        # contract over the layer dimension with a single GEMV instead of
+        # materializing the weighted (count, T, B, C) product and reducing it.
+        # The GEMV runs in the dtype the layers are stored in (fp16/bf16 GEMMs
+        # accumulate in fp32); under autocast it would otherwise copy the whole
+        # fp32 stack to bf16 on every pop.
+        with torch.autocast(device_type=layers.device.type, enabled=False):
+            w = self._weight_table(layers.dtype)[self.count - 1, : self.count]
+            ret = torch.matmul(w, layers.view(self.count, -1)).view(layers.size()[1:])
+        if self.count == self.layer_num and self.training:
+            # last pop of the forward, don't keep its graph alive
+            self.weight_table = None
         if self.count == 1 or self.normalize_before:
             return ret
-        return self.layer_norms[self.count - 2](ret)
+        return self.layer_norm(ret, self.count - 2)
+
+    def _weight_table(self, dtype):
+        """The normalized (layer_num, layer_num) weights in *dtype*.
+
+        Built once per forward instead of once per pop(). In training clean()
+        drops it, since optimizers update the weight through ``.data``; in
+        eval it is kept until the next train()/eval() or state dict load.
+        """
+        if self.weight_table is None or self.weight_table.dtype != dtype:
+            w = self.weight
+            if self.softmax_weight:
+                # row i is a softmax over the first i + 1 layers
+                mask = torch.ones_like(w, dtype=torch.bool).triu(1)
+                w = torch.softmax(w.float().masked_fill(mask, float('-inf')), dim=1)
+            self.weight_table = w.to(dtype)
+        return self.weight_table
 
     def clean(self):
         self.sum = None
         self.count = 0
-        self.layers = []
+        self.layers = [None] * self.layer_num
+        if self.training:
+            self.weight_table = None
+
+    def train(self, mode=True):
+        self.weight_table = None
+        return super(LearnableDenseLayerHistory, self).train(mode)
 
-    def get_loss(self):
-        return (0.5 * (self.weight.sum(1) - 1.0) ** 2).mean()
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.weight_table = None
+        super(LearnableDenseLayerHistory, self)._load_from_state_dict(*args, **kwargs)
 
     def print_weight(self):
         print(self.weight)
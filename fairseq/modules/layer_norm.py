@@ -7,12 +7,16 @@
 
 import torch
 
+# resolve apex once; a failed import is not cached by Python and would be
+# retried for every LayerNorm of a deep model
+try:
+    from apex.normalization import FusedLayerNorm as _FusedLayerNorm
+    has_fused_layernorm = True
+except ImportError:
+    has_fused_layernorm = False
+
 
 def LayerNorm(normalized_shape, eps=1e-5, elementwise_affine=True):
-    if torch.cuda.is_available():
-        try:
-            from apex.normalization import FusedLayerNorm
-            return FusedLayerNorm(normalized_shape, eps, elementwise_affine)
-        except ImportError:
-            pass
+    if has_fused_layernorm and torch.cuda.is_available():
+        return _FusedLayerNorm(normalized_shape, eps, elementwise_affine)
     return torch.nn.LayerNorm(normalized_shape, eps, elementwise_affine)
@@ -11,6 +11,9 @@ from torch.nn import Parameter
 import torch.nn.functional as F
 
 from fairseq import utils
+from fairseq.modules.fp8_kv_cache import append_fp8_kv
+
+_HAS_SDPA = hasattr(F, 'scaled_dot_product_attention')
 
 
 class MultiheadAttention(nn.Module):
@@ -42,6 +45,8 @@ class MultiheadAttention(nn.Module):
             self.bias_k = self.bias_v = None
 
         self.add_zero_attn = add_zero_attn
+        # store the incremental self-attention keys/values in float8
+        self.fp8_kv_cache = False
 
         self.reset_parameters()
 
@@ -62,14 +67,19 @@ class MultiheadAttention(nn.Module):
             nn.init.xavier_normal_(self.bias_v)
 
     def forward(self, query, key, value, key_padding_mask=None, incremental_state=None,
-                need_weights=True, static_kv=False, attn_mask=None):
+                need_weights=True, static_kv=False, attn_mask=None, is_causal=False):
         """Input shape: Time x Batch x Channel
 
         Self-attention can be implemented by passing in the same arguments for
         query, key and value. Timesteps can be masked by supplying a T x T mask in the
         `attn_mask` argument. Padding elements can be excluded from
         the key by passing a binary ByteTensor (`key_padding_mask`) with shape:
-        batch x src_len, where padding elements are indicated by 1s.
+        batch x src_len, where padding elements are indicated by 1s. A floating
+        point `key_padding_mask` of the same shape is taken as an additive bias
+        (``-inf`` at padding elements), which lets callers convert the mask once
+        and share it across layers. Setting `is_causal` declares that
+        `attn_mask` is the usual future mask, which the fused kernel can then
+        apply implicitly without reading it.
         """
 
         qkv_same = query.data_ptr() == key.data_ptr() == value.data_ptr()
@@ -80,6 +90,10 @@ class MultiheadAttention(nn.Module):
         assert list(query.size()) == [tgt_len, bsz, embed_dim]
         assert key.size() == value.size()
 
+        if qkv_same and incremental_state is None and self._can_use_sdpa(need_weights):
+            return self._packed_self_attn(query, key_padding_mask, attn_mask, is_causal), None
+
+        static_kv_cached = False
         if incremental_state is not None:
             saved_state = self._get_input_buffer(incremental_state)
             if 'prev_key' in saved_state:
@@ -88,6 +102,7 @@ class MultiheadAttention(nn.Module):
                 if static_kv:
                     assert kv_same and not qkv_same
                     key = value = None
+                    static_kv_cached = True
         else:
             saved_state = None
 
@@ -106,7 +121,11 @@ class MultiheadAttention(nn.Module):
             q = self.in_proj_q(query)
             k = self.in_proj_k(key)
             v = self.in_proj_v(value)
-        q *= self.scaling
+
+        # the fused kernel applies the 1/sqrt(head_dim) scaling itself
+        use_sdpa = self._can_use_sdpa(need_weights)
+        if not use_sdpa:
+            q = q * self.scaling
 
         if self.bias_k is not None:
             assert self.bias_v is not None
@@ -124,7 +143,15 @@ class MultiheadAttention(nn.Module):
         if v is not None:
             v = v.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
 
-        if saved_state is not None:
+        if static_kv_cached:
+            # static keys and values were projected on the first step; use
+            # them as they are without writing the buffer back
+            k = saved_state['prev_key'].view(bsz * self.num_heads, -1, self.head_dim)
+            v = saved_state['prev_value'].view(bsz * self.num_heads, -1, self.head_dim)
+        elif saved_state is not None and self._use_fp8_kv_cache(saved_state, static_kv):
+            k, v = append_fp8_kv(saved_state, k, v, bsz, self.num_heads)
+            self._set_input_buffer(incremental_state, saved_state)
+        elif saved_state is not None:
             # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
             if 'prev_key' in saved_state:
                 prev_key = saved_state['prev_key'].view(bsz * self.num_heads, -1, self.head_dim)
@@ -159,6 +186,12 @@ class MultiheadAttention(nn.Module):
                 key_padding_mask = torch.cat(
                     [key_padding_mask, torch.zeros(key_padding_mask.size(0), 1).type_as(key_padding_mask)], dim=1)
 
+        if use_sdpa:
+            q = q.view(bsz, self.num_heads, tgt_len, self.head_dim)
+            k = k.view(bsz, self.num_heads, src_len, self.head_dim)
+            v = v.view(bsz, self.num_heads, src_len, self.head_dim)
+            return self._sdpa(q, k, v, key_padding_mask, attn_mask, is_causal), None
+
         attn_weights = torch.bmm(q, k.transpose(1, 2))
         assert list(attn_weights.size()) == [bsz * self.num_heads, tgt_len, src_len]
 
@@ -171,7 +204,9 @@ class MultiheadAttention(nn.Module):
         if key_padding_mask is not None:
             # don't attend to padding symbols
             attn_weights = attn_weights.view(bsz, self.num_heads, tgt_len, src_len)
-            if self.onnx_trace:
+            if key_padding_mask.is_floating_point():
+                attn_weights = attn_weights + key_padding_mask.unsqueeze(1).unsqueeze(2).type_as(attn_weights)
+            elif self.onnx_trace:
                 attn_weights = torch.where(
                     key_padding_mask.unsqueeze(1).unsqueeze(2),
                     torch.Tensor([float("-Inf")]),
@@ -208,6 +243,67 @@ class MultiheadAttention(nn.Module):
 
         return attn, attn_weights
 
+    def _use_fp8_kv_cache(self, saved_state, static_kv):
+        # a full precision state passed in by the caller is extended as is
+        return self.fp8_kv_cache and not static_kv and not self.onnx_trace and 'prev_key' not in saved_state
+
+    def _can_use_sdpa(self, need_weights):
+        """Whether the fused ``F.scaled_dot_product_attention`` kernel can be used.
+
+        The fused kernel never materializes the attention probabilities, so it
+        is only selected when the caller does not need them.
+        """
+        return (
+            _HAS_SDPA and not need_weights and not self.onnx_trace
+            and self.bias_k is None and not self.add_zero_attn
+        )
+
+    def _packed_self_attn(self, query, key_padding_mask, attn_mask, is_causal=False):
+        """Self-attention from a single packed QKV projection.
+
+        The output of the fused ``(3 * embed_dim, embed_dim)`` GEMM is viewed
+        directly as per-head q, k and v, so no per-tensor copies are made.
+        """
+        tgt_len, bsz, embed_dim = query.size()
+        qkv = self._in_proj(query).view(tgt_len, bsz, 3, self.num_heads, self.head_dim)
+        q, k, v = qkv.permute(2, 1, 3, 0, 4).unbind(0)
+        return self._sdpa(q, k, v, key_padding_mask, attn_mask, is_causal)
+
+    def _sdpa(self, q, k, v, key_padding_mask, attn_mask, is_causal=False):
+        """Fused attention over q, k, v of shape `(bsz, num_heads, len, head_dim)`.
+
+        Returns the projected attention output of shape `(tgt_len, bsz, embed_dim)`.
+        """
+        bsz, _, tgt_len, _ = q.size()
+        src_len = k.size(2)
+
+        # without padding the causal kernel variant needs no mask at all; it
+        # can't be combined with an explicit mask though
+        is_causal = is_causal and key_padding_mask is None and tgt_len == src_len
+        if is_causal:
+            attn_mask = None
+
+        # combine the padding and future masks into a single additive mask
+        mask = None
+        if key_padding_mask is not None and key_padding_mask.is_floating_point():
+            mask = key_padding_mask.view(bsz, 1, 1, src_len).to(q.dtype)
+        elif key_padding_mask is not None:
+            mask = q.new_zeros(bsz, 1, 1, src_len).masked_fill(
+                key_padding_mask.view(bsz, 1, 1, src_len).bool(),
+                float('-inf'),
+            )
+        if attn_mask is not None:
+            attn_mask = attn_mask.to(q.dtype)
+            mask = attn_mask if mask is None else mask + attn_mask
+
+        attn = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=mask,
+            dropout_p=self.dropout if self.training else 0.,
+            is_causal=is_causal,
+        )
+        attn = attn.permute(2, 0, 1, 3).contiguous().view(tgt_len, bsz, self.embed_dim)
+        return self.out_proj(attn)
+
     def in_proj_qkv(self, query):
         return self._in_proj(query).chunk(3, dim=-1)
 
@@ -11,6 +11,7 @@ from torch.nn import Parameter
 import torch.nn.functional as F
 
 from fairseq import utils
+from fairseq.modules.fp8_kv_cache import append_fp8_kv
 
 
 class RelativeMultiheadAttention(nn.Module):
@@ -49,6 +50,9 @@ class RelativeMultiheadAttention(nn.Module):
         if not self.k_only:
             self.relative_position_values = Parameter(torch.Tensor(2 * self.max_relative_length + 1, self.head_dim))
 
+        # store the incremental self-attention keys/values in float8
+        self.fp8_kv_cache = False
+
         self.reset_parameters()
 
         self.onnx_trace = False
@@ -71,14 +75,18 @@ class RelativeMultiheadAttention(nn.Module):
             nn.init.xavier_uniform_(self.relative_position_values)
 
     def forward(self, query, key, value, key_padding_mask=None, incremental_state=None,
-                need_weights=True, static_kv=False, attn_mask=None):
+                need_weights=True, static_kv=False, attn_mask=None, is_causal=False):
         """Input shape: Time x Batch x Channel
 
         Self-attention can be implemented by passing in the same arguments for
         query, key and value. Timesteps can be masked by supplying a T x T mask in the
         `attn_mask` argument. Padding elements can be excluded from
         the key by passing a binary ByteTensor (`key_padding_mask`) with shape:
-        batch x src_len, where padding elements are indicated by 1s.
+        batch x src_len, where padding elements are indicated by 1s. A floating
+        point `key_padding_mask` of the same shape is taken as an additive bias
+        (``-inf`` at padding elements), which lets callers convert the mask once
+        and share it across layers. `is_causal` is accepted for compatibility
+        with :class:`MultiheadAttention`; `attn_mask` is always applied.
         """
 
         qkv_same = query.data_ptr() == key.data_ptr() == value.data_ptr()
@@ -100,7 +108,12 @@ class RelativeMultiheadAttention(nn.Module):
         else:
             saved_state = None
 
-        if qkv_same:
+        heads_first = qkv_same and self.bias_k is None
+        if heads_first:
+            # self-attention: rearrange the packed projection into heads with
+            # a single copy instead of one per q, k and v
+            q, k, v = self._in_proj_qkv_heads(query)
+        elif qkv_same:
             # self-attention
             q, k, v = self.in_proj_qkv(query)
         elif kv_same:
@@ -115,7 +128,7 @@ class RelativeMultiheadAttention(nn.Module):
             q = self.in_proj_q(query)
             k = self.in_proj_k(key)
             v = self.in_proj_v(value)
-        q *= self.scaling
+        q = q * self.scaling
 
         if self.bias_k is not None:
             assert self.bias_v is not None
@@ -127,13 +140,17 @@ class RelativeMultiheadAttention(nn.Module):
                 key_padding_mask = torch.cat(
                     [key_padding_mask, key_padding_mask.new_zeros(key_padding_mask.size(0), 1)], dim=1)
 
-        q = q.contiguous().view(tgt_len, bsz * self.num_heads, self.head_dim).transpose(0, 1)
-        if k is not None:
-            k = k.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
-        if v is not None:
-            v = v.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
+        if not heads_first:
+            q = q.contiguous().view(tgt_len, bsz * self.num_heads, self.head_dim).transpose(0, 1)
+            if k is not None:
+                k = k.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
+            if v is not None:
+                v = v.contiguous().view(-1, bsz * self.num_heads, self.head_dim).transpose(0, 1)
 
-        if saved_state is not None:
+        if saved_state is not None and self._use_fp8_kv_cache(saved_state, static_kv):
+            k, v = append_fp8_kv(saved_state, k, v, bsz, self.num_heads)
+            self._set_input_buffer(incremental_state, saved_state)
+        elif saved_state is not None:
             # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
             if 'prev_key' in saved_state:
                 prev_key = saved_state['prev_key'].view(bsz * self.num_heads, -1, self.head_dim)
@@ -190,7 +207,12 @@ class RelativeMultiheadAttention(nn.Module):
         if key_padding_mask is not None:
             # don't attend to padding symbols
             relative_attn_weights = relative_attn_weights.view(bsz, self.num_heads, tgt_len, src_len)
-            if self.onnx_trace:
+            if key_padding_mask.is_floating_point():
+                relative_attn_weights = (
+                    relative_attn_weights
+                    + key_padding_mask.unsqueeze(1).unsqueeze(2).type_as(relative_attn_weights)
+                ).view(bsz * self.num_heads, tgt_len, src_len)
+            elif self.onnx_trace:
                 relative_attn_weights = torch.where(
                     key_padding_mask.unsqueeze(1).unsqueeze(2),
                     torch.Tensor([float("-Inf")]),
@@ -233,6 +255,14 @@ class RelativeMultiheadAttention(nn.Module):
 
         return attn, relative_attn_weights
 
+    def _in_proj_qkv_heads(self, query):
+        """Project *query* with the packed weight and return q, k and v of
+        shape `(bsz * num_heads, seq_len, head_dim)`."""
+        tgt_len, bsz, _ = query.size()
+        qkv = self._in_proj(query).view(tgt_len, bsz, 3, self.num_heads, self.head_dim)
+        qkv = qkv.permute(2, 1, 3, 0, 4).reshape(3, bsz * self.num_heads, tgt_len, self.head_dim)
+        return qkv.unbind(0)
+
     def in_proj_qkv(self, query):
         return self._in_proj(query).chunk(3, dim=-1)
 
@@ -279,6 +309,10 @@ class RelativeMultiheadAttention(nn.Module):
             buffer,
         )
 
+    def _use_fp8_kv_cache(self, saved_state, static_kv):
+        # a full precision state passed in by the caller is extended as is
+        return self.fp8_kv_cache and not static_kv and not self.onnx_trace and 'prev_key' not in saved_state
+
     def _generate_relative_positions_matrix(self, length, max_relative_length, incremental_state):
         if not incremental_state:
             # training process
@@ -0,0 +1,41 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+_HAS_FUSED_RMS_NORM = hasattr(F, 'rms_norm')
+
+
+def rms_norm(x, normalized_shape, weight, eps=1e-6):
+    if _HAS_FUSED_RMS_NORM:
+        return F.rms_norm(x, normalized_shape, weight, eps)
+    # accumulate in fp32 so that fp16 inputs don't overflow in pow(2)
+    out = x.float()
+    out = out * torch.rsqrt(out.pow(2).mean(-1, keepdim=True) + eps)
+    return out.type_as(x) * weight
+
+
+class RMSNorm(nn.Module):
+    """Root mean square layer normalization (Zhang and Sennrich, 2019).
+
+    Unlike LayerNorm the input is not re-centered, so only a single reduction
+    over the last dimension is needed and there is no bias term.
+    """
+
+    def __init__(self, normalized_shape, eps=1e-6):
+        super().__init__()
+        self.normalized_shape = (normalized_shape,)
+        self.eps = eps
+        self.weight = nn.Parameter(torch.ones(normalized_shape))
+
+    def forward(self, x):
+        return rms_norm(x, self.normalized_shape, self.weight, self.eps)
+
+    def extra_repr(self):
+        return '{normalized_shape}, eps={eps}'.format(**self.__dict__)
@@ -26,11 +26,13 @@ class SinusoidalPositionalEmbedding(nn.Module):
         self.embedding_dim = embedding_dim
         self.padding_idx = padding_idx
         self.left_pad = left_pad
-        self.weights = SinusoidalPositionalEmbedding.get_embedding(
+        # a non-persistent buffer follows the module across .cuda()/.half(),
+        # so the table is converted once rather than on every call
+        self.register_buffer('weights', SinusoidalPositionalEmbedding.get_embedding(
             init_size,
             embedding_dim,
             padding_idx,
-        )
+        ), persistent=False)
         self.onnx_trace = False
         self.register_buffer('_float_tensor', torch.FloatTensor(1))
 
@@ -58,7 +60,12 @@ class SinusoidalPositionalEmbedding(nn.Module):
 
     def forward(self, input, incremental_state=None, timestep=None):
         """Input is expected to be of size [bsz x seqlen]."""
-        bsz, seq_len = torch.onnx.operators.shape_as_tensor(input)
+        if self.onnx_trace:
+            bsz, seq_len = torch.onnx.operators.shape_as_tensor(input)
+        else:
+            # plain ints keep the single-step lookup below a view instead of
+            # indexing the table with a CPU tensor
+            bsz, seq_len = input.size()
         max_pos = self.padding_idx + 1 + seq_len
         if self.weights is None or max_pos > self.weights.size(0):
             # recompute/expand embeddings if needed
@@ -66,8 +73,7 @@ class SinusoidalPositionalEmbedding(nn.Module):
                 max_pos,
                 self.embedding_dim,
                 self.padding_idx,
-            )
-        self.weights = self.weights.type_as(self._float_tensor)
+            ).type_as(self._float_tensor)
 
         if incremental_state is not None:
             # positions is the same for every token when decoding a single step
@@ -6,6 +6,7 @@
 # can be found in the PATENTS file in the same directory.
 
 from collections import defaultdict, OrderedDict
+import contextlib
 import importlib.util
 import logging
 import os
@@ -80,16 +81,25 @@ def load_model_state(filename, model):
         state['model']['encoder.history.weight'] = nn.Parameter(torch.Tensor(new_layer, new_layer).fill_(1.0).tril())
         state['model']['encoder.history.weight'].data = state['model']['encoder.history.weight'].data / state['model'][
             'encoder.history.weight'].data.sum(1, keepdim=True)
-        for i in range(layer):
-            for j in range(i + 1):
-                state['model']['encoder.history.weight'][i][j] = temp[i][j].float()
-                state['model']['encoder.history.weight'][i][j].half()
+        # the new weight is a leaf that requires grad; fill it without autograd
+        with torch.no_grad():
+            for i in range(layer):
+                for j in range(i + 1):
+                    state['model']['encoder.history.weight'][i][j] = temp[i][j].float()
+                    state['model']['encoder.history.weight'][i][j].half()
         iternum = len(state['args'].k) - 2
         dim = state['args'].encoder_embed_dim
-        state['model']['encoder.history.layer_norms.' + str(iternum) + '.weight'] = nn.Parameter(torch.Tensor(dim))
-        nn.init.ones_(state['model']['encoder.history.layer_norms.' + str(iternum) + '.weight'])
-        state['model']['encoder.history.layer_norms.' + str(iternum) + '.bias'] = nn.Parameter(torch.Tensor(dim))
-        nn.init.zeros_(state['model']['encoder.history.layer_norms.' + str(iternum) + '.bias'])
+        if 'encoder.history.norm_weight' in state['model']:
+            # grouped history norms: stack.py already added the row for the new
+            # layer, reset row iternum to identity like the per-layer keys below
+            state['model']['encoder.history.norm_weight'][iternum] = 1.
+            if 'encoder.history.norm_bias' in state['model']:
+                state['model']['encoder.history.norm_bias'][iternum] = 0.
+        else:
+            state['model']['encoder.history.layer_norms.' + str(iternum) + '.weight'] = nn.Parameter(torch.Tensor(dim))
+            nn.init.ones_(state['model']['encoder.history.layer_norms.' + str(iternum) + '.weight'])
+            state['model']['encoder.history.layer_norms.' + str(iternum) + '.bias'] = nn.Parameter(torch.Tensor(dim))
+            nn.init.zeros_(state['model']['encoder.history.layer_norms.' + str(iternum) + '.bias'])
         model.load_state_dict(state['model'], strict=True)
     except Exception:
         raise Exception('Cannot load model parameters from checkpoint, '
@@ -179,8 +189,10 @@ def load_ensemble_for_inference(filenames, task, model_arg_overrides=None):
         if model_arg_overrides is not None:
             args = override_model_args(args, model_arg_overrides)
 
-        # build model for ensemble
-        model = task.build_model(args)
+        # build model for ensemble; all parameters are overwritten by the
+        # checkpoint below, so skip their random initialization
+        with skip_init_weights():
+            model = task.build_model(args)
         model.upgrade_state_dict(state['model'])
         model.load_state_dict(state['model'], strict=True)
         ensemble.append(model)
@@ -192,6 +204,35 @@ def load_ensemble_for_inference(filenames, task, model_arg_overrides=None):
     return ensemble, args
 
 
+_INIT_FUNCTIONS = (
+    'uniform_', 'normal_', 'constant_', 'ones_', 'zeros_', 'xavier_uniform_',
+    'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_', 'orthogonal_',
+)
+
+
+@contextlib.contextmanager
+def skip_init_weights():
+    """Turn the in-place ``torch.nn.init`` functions into no-ops.
+
+    Meant for building a model whose parameters are loaded from a checkpoint
+    right afterwards: the parameters are still allocated, but the random
+    initialization kernels, which dominate construction time for the deep
+    models, are not run.
+    """
+    saved = {name: getattr(nn.init, name) for name in _INIT_FUNCTIONS}
+
+    def skip(tensor, *args, **kwargs):
+        return tensor
+
+    try:
+        for name in saved:
+            setattr(nn.init, name, skip)
+        yield
+    finally:
+        for name, fn in saved.items():
+            setattr(nn.init, name, fn)
+
+
 def override_model_args(args, model_arg_overrides):
     # Uses model_arg_overrides {'arg_name': arg} to override model args
     for arg_name, arg_val in model_arg_overrides.items():
@@ -1,93 +1,122 @@
 import collections
+import os
+import re
 import sys
 
 import torch
-#Number of parameters for each encoder layer
-# rpr-network = 13,base-network = 12
-num_of_layerpara = 13
+
 strategy = 1
+# grouped (layers, dim) norm parameters of the layer history
+HISTORY_NORM_KEYS = ('encoder.history.norm_weight', 'encoder.history.norm_bias')
+# encoder.layers.<id>.<param>
+LAYER_KEY = re.compile(r'^encoder\.layers\.(\d+)\.(.*)$')
+# encoder.history.layer_norms.<id>.<param> of checkpoints from before the
+# history norms were grouped
+LEGACY_NORM_KEY = re.compile(r'^encoder\.history\.layer_norms\.(\d+)\.(weight|bias)$')
+
+
+def group_history_norms(state):
+    """Stack legacy per-layer history norm keys into the grouped tensors.
+
+    The stacked checkpoint is always written in the grouped layout. The
+    strategies below are the only place that adds history norm rows;
+    fairseq.utils.load_model_state just resets the row of the new layer.
+    """
+    norms = collections.defaultdict(dict)
+    for k in list(state.keys()):
+        m = LEGACY_NORM_KEY.match(k)
+        if m is not None:
+            norms[m.group(2)][int(m.group(1))] = state.pop(k)
+    for name, rows in norms.items():
+        state['encoder.history.norm_' + name] = torch.stack([rows[i] for i in sorted(rows)])
+
+
+def bucket_layer_keys(state):
+    """Group the encoder layer parameters by layer id.
+
+    Returns a dict mapping a layer id to {param name: tensor}, so the
+    strategies below only touch the keys they copy.
+    """
+    layers = collections.defaultdict(dict)
+    for k, v in state.items():
+        m = LAYER_KEY.match(k)
+        if m is not None:
+            layers[int(m.group(1))][m.group(2)] = v
+    return layers
+
+
+def copy_layer(lst, prefix, params, new_id):
+    for name, v in params.items():
+        lst.append(['{}.{}.{}'.format(prefix, new_id, name), v])
+
+
+def batch_clone(pairs):
+    """Copy the tensors of *pairs* with one torch.stack per shape/dtype group.
+
+    Every copied layer has the same parameter shapes, so this replaces one
+    small allocation + memcpy per key with one per distinct shape.
+    """
+    groups = collections.defaultdict(list)
+    for k, v in pairs:
+        groups[(v.shape, v.dtype, v.device)].append((k, v))
+    cloned = []
+    for group in groups.values():
+        keys, vs = zip(*group)
+        cloned.extend(zip(keys, torch.stack([v.detach() for v in vs]).unbind(0)))
+    return cloned
+
+
+def load_checkpoint(path):
+    """Memory-map the checkpoint so only the tensors that are copied are read."""
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+    except (RuntimeError, TypeError):
+        # legacy (non-zipfile) checkpoints and torch < 2.1 cannot be mmapped
+        return torch.load(path, map_location='cpu')
+
 
 def main():
-    ckpt = torch.load(sys.argv[1])
+    # the output is written while the mmapped input is still being read
+    assert os.path.abspath(sys.argv[1]) != os.path.abspath(sys.argv[2]), \
+        'the stacked checkpoint must be written to a new file'
+    ckpt = load_checkpoint(sys.argv[1])
+    state = ckpt['model']
+    group_history_norms(state)
+    layers = bucket_layer_keys(state)
+    # lst holds the new keys whose tensors have to be copied, shared the
+    # ones that can point at an existing (or freshly concatenated) tensor.
+    # Nothing below modifies a tensor in place, so a copied layer can alias
+    # its source; torch.save writes a shared storage only once.
     lst = []
+    shared = []
     # Number of copy encoder layers
     counter_layer = int(sys.argv[3])
+    current_layers = ckpt['args'].encoder_layers
     #Copy all layers before,such as 6->12->24->48
     if strategy == 0:
-        for k, v in ckpt['model'].items():
-            k_split = k.split('.')
-            if k_split[0] == 'encoder' and k_split[1] == 'layers':
-                l_id = int(k_split[2])
-                k_split[2] = str(l_id + ckpt['args'].encoder_layers)
-                new_k = '.'.join(k_split)
-                lst.append([new_k, v.clone()])
-            if k_split[0] == 'encoder' and k_split[1] == 'history' and k_split[2] == 'layer_norms':
-                l_id = int(k_split[3])
-                k_split[3] = str(l_id + ckpt['args'].encoder_layers)
-                new_k = '.'.join(k_split)
-                lst.append([new_k, v.clone()])
+        for l_id, params in layers.items():
+            copy_layer(shared, 'encoder.layers', params, l_id + current_layers)
+        for k in HISTORY_NORM_KEYS:
+            if k in state:
+                shared.append([k, torch.cat([state[k], state[k]])])
     #sdt g top-most
-    elif strategy == 1:
-        current_layers = ckpt['args'].encoder_layers
-        count_layer = 0
-        for k, v in ckpt['model'].items():
-            k_split = k.split('.')
-            if k_split[0] == 'encoder' and k_split[1] == 'layers' and int(k_split[2]) == current_layers - counter_layer:
-                l_id = int(k_split[2])
-                k_split[2] = str(l_id + int(sys.argv[3]))
-                new_k = '.'.join(k_split)
-                lst.append([new_k, v.clone()])
-                count_layer += 1
-                if count_layer == num_of_layerpara:
-                    counter_layer -= 1
-                    count_layer = 0
-            if k_split[0] == 'encoder' and k_split[1] == 'history' and k_split[2] == 'layer_norms':
-                if int(k_split[3]) == len(ckpt['args'].k)-2:
-                    l_id = int(k_split[3])
-                    k_split[3] = str(l_id + 1)
-                    new_k = '.'.join(k_split)
-                    lst.append([new_k, v.clone()])
-    # top only
-    elif strategy == 2:
-        current_layers = ckpt['args'].encoder_layers
-        count_layer = 0
-        num = 1
-        for k, v in ckpt['model'].items():
-            k_split = k.split('.')
-            if k_split[0] == 'encoder' and k_split[1] == 'layers' and int(k_split[2]) == current_layers - 1:
-                l_id = int(k_split[2])
-                for i in range(counter_layer):
-                    k_split[2] = str(l_id + i + 1)
-                    new_k = '.'.join(k_split)
-                    lst.append([new_k, v.clone()])
-            if k_split[0] == 'encoder' and k_split[1] == 'history' and k_split[2] == 'layer_norms':
-                if int(k_split[3]) == len(ckpt['args'].k) - 2:
-                    l_id = int(k_split[3])
-                    k_split[3] = str(l_id + 1)
-                    new_k = '.'.join(k_split)
-                    lst.append([new_k, v.clone()])
+    elif strategy == 1 or strategy == 2:
+        for i in range(counter_layer):
+            # sdt g top-most copies the top counter_layer layers on top of the
+            # stack in order, top only repeats the last layer
+            src = current_layers - counter_layer + i if strategy == 1 else current_layers - 1
+            copy_layer(shared, 'encoder.layers', layers[src], current_layers + i)
+        for k in HISTORY_NORM_KEYS:
+            if k in state:
+                shared.append([k, torch.cat([state[k], state[k][-1:]])])
     #Interpolation no sparse connections
     elif strategy == 3:
-        layer = 0
-        count = 0
-        for k, v in ckpt['model'].items():
-            # print(k)
-            k_split = k.split('.')
-            if k_split[0] == 'encoder' and k_split[1] == 'layers':
-                l_id = int(k_split[2]) + layer
-                k_split[2] = str(l_id)
-                new_k1 = '.'.join(k_split)
-                k_split[2] = str(l_id + 1)
-                new_k2 = '.'.join(k_split)
-                lst.append([new_k1, v])
-                lst.append([new_k2, v.clone()])
-                count += 1
-                if count == 13:
-                    layer = layer + 1
-                    count = 0
+        for l_id, params in layers.items():
+            copy_layer(shared, 'encoder.layers', params, 2 * l_id)
+            copy_layer(lst, 'encoder.layers', params, 2 * l_id + 1)
     #exit()
-    for k, v in lst:
-        ckpt['model'][k] = v
+    for k, v in batch_clone(lst) + shared:
+        state[k] = v
 
 
     if strategy == 0 or strategy == 3:
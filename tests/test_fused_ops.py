@@ -0,0 +1,45 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from fairseq.modules.fused_ops import linear_relu_dropout
+
+
+class TestFusedOps(unittest.TestCase):
+
+    def test_linear_relu_dropout_inference(self):
+        torch.manual_seed(0)
+        linear = nn.Linear(16, 32)
+        x = torch.randn(5, 2, 16)
+        with torch.no_grad():
+            out = linear_relu_dropout(linear, x, 0.1, False)
+            ref = F.relu(linear(x))
+        self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+
+    def test_linear_relu_dropout_autocast(self):
+        torch.manual_seed(0)
+        linear = nn.Linear(16, 32)
+        x = torch.randn(5, 2, 16)
+        # autocast doesn't cast the inputs of the GEMM epilogue op on every
+        # device, so the unfused path is taken
+        with torch.no_grad(), torch.autocast(device_type='cpu', dtype=torch.bfloat16), \
+                mock.patch.object(torch, '_addmm_activation', create=True) as addmm_activation:
+            out = linear_relu_dropout(linear, x, 0.1, False)
+            ref = F.relu(linear(x))
+        addmm_activation.assert_not_called()
+        self.assertEqual(out.dtype, ref.dtype)
+        self.assertTrue(torch.equal(out, ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
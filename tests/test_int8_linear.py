@@ -0,0 +1,52 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import unittest
+
+import torch
+import torch.nn as nn
+
+from fairseq.modules import Int8Linear
+from tests.test_sdt_transformer import _build_model
+
+
+class TestInt8Linear(unittest.TestCase):
+
+    def test_matches_float_linear(self):
+        torch.manual_seed(0)
+        linear = nn.Linear(32, 64)
+        qlinear = Int8Linear.from_float(linear)
+        self.assertEqual(qlinear.weight.dtype, torch.int8)
+
+        x = torch.randn(5, 2, 32)
+        with torch.no_grad():
+            ref = linear(x)
+            out = qlinear(x)
+        self.assertEqual(out.size(), ref.size())
+        self.assertLess((out - ref).abs().max().item(), 5e-2)
+
+        # the int8 weight-only kernel has no backward; the fallback is used
+        out_grad = qlinear(x.requires_grad_())
+        self.assertTrue(torch.allclose(out_grad, out, atol=1e-5))
+
+    def test_decoder_int8_ffn(self):
+        torch.manual_seed(0)
+        model = _build_model(int8_ffn=True).eval()
+        src_tokens = torch.randint(4, 14, (2, 6))
+        prev_output_tokens = torch.randint(4, 14, (2, 5))
+        with torch.no_grad():
+            ref, _ = model(src_tokens, torch.tensor([6, 6]), prev_output_tokens)
+            model.make_generation_fast_()
+            out, _ = model(src_tokens, torch.tensor([6, 6]), prev_output_tokens)
+        for layer in model.decoder.layers:
+            self.assertIsInstance(layer.fc1, Int8Linear)
+            self.assertIsInstance(layer.fc2, Int8Linear)
+        self.assertLess((out - ref).abs().max().item(), 5e-2)
+
+
+if __name__ == '__main__':
+    unittest.main()
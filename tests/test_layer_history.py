@@ -0,0 +1,204 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import argparse
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import stack
+from fairseq import utils
+from fairseq.models import BaseFairseqModel
+from fairseq.modules.layer_history import LearnableDenseLayerHistory
+
+
+def _history_args(normalize_before, norm_type='layernorm', softmax_weight=False):
+    return argparse.Namespace(
+        k=[0, 2, 4, 6],
+        encoder_embed_dim=8,
+        encoder_normalize_before=normalize_before,
+        norm_type=norm_type,
+        history_softmax_weight=softmax_weight,
+    )
+
+
+def _reference(history, layers):
+    """Dense combination of *layers* computed with one LayerNorm call each."""
+    out = []
+    normed = [layers[0]]
+    for i, layer in enumerate(layers[1:]):
+        if history.normalize_before:
+            layer = F.layer_norm(layer, (8,), history.norm_weight[i], history.norm_bias[i])
+        normed.append(layer)
+        ret = sum(w * x for w, x in zip(history.weight[i + 1, :i + 2], normed))
+        if not history.normalize_before:
+            ret = F.layer_norm(ret, (8,), history.norm_weight[i], history.norm_bias[i])
+        out.append(ret)
+    return out
+
+
+class _GrowingEncoderModel(BaseFairseqModel):
+    """Just the encoder layers and history that stack.py and load_model_state touch."""
+
+    def __init__(self, args):
+        super().__init__()
+        self.encoder = nn.Module()
+        self.encoder.layers = nn.ModuleList(nn.Linear(8, 8) for _ in range(args.encoder_layers))
+        self.encoder.history = LearnableDenseLayerHistory(args, is_encoder=True)
+
+
+def _growing_args(layers):
+    args = _history_args(True)
+    args.encoder_layers = layers
+    args.k = list(range(layers + 1))
+    return args
+
+
+class TestLayerHistory(unittest.TestCase):
+
+    def _run(self, history, layers):
+        history.clean()
+        history.add(layers[0])
+        out = []
+        for layer in layers[1:]:
+            history.add(layer)
+            out.append(history.pop())
+        return out
+
+    def _check(self, normalize_before):
+        torch.manual_seed(0)
+        history = LearnableDenseLayerHistory(_history_args(normalize_before), is_encoder=True)
+        with torch.no_grad():
+            history.norm_weight.uniform_(0.5, 1.5)
+            history.norm_bias.uniform_(-0.5, 0.5)
+        layers = [torch.randn(5, 3, 8) for _ in range(4)]
+        expected = _reference(history, layers)
+
+        for grad in (True, False):
+            with torch.set_grad_enabled(grad):
+                for out, ref in zip(self._run(history, layers), expected):
+                    self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+
+    def test_pre_norm(self):
+        self._check(normalize_before=True)
+
+    def test_post_norm(self):
+        self._check(normalize_before=False)
+
+    def test_softmax_weight_starts_uniform(self):
+        torch.manual_seed(0)
+        layers = [torch.randn(5, 3, 8) for _ in range(4)]
+        history = LearnableDenseLayerHistory(_history_args(True), is_encoder=True)
+        softmax_history = LearnableDenseLayerHistory(_history_args(True, softmax_weight=True), is_encoder=True)
+        for out, ref in zip(self._run(softmax_history, layers), self._run(history, layers)):
+            self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+
+    def test_weight_update_through_data(self):
+        torch.manual_seed(0)
+        layers = [torch.randn(5, 3, 8) for _ in range(4)]
+        history = LearnableDenseLayerHistory(_history_args(True, softmax_weight=True), is_encoder=True)
+        with torch.no_grad():
+            self._run(history, layers)
+        # optimizers and FP16Trainer update parameters through .data
+        history.weight.data.add_(torch.randn(4, 4))
+        fresh = LearnableDenseLayerHistory(_history_args(True, softmax_weight=True), is_encoder=True)
+        fresh.load_state_dict(history.state_dict())
+        with torch.no_grad():
+            for out, ref in zip(self._run(history, layers), self._run(fresh, layers)):
+                self.assertTrue(torch.allclose(out, ref, atol=1e-6))
+
+    def test_weight_table_cached_in_eval(self):
+        torch.manual_seed(0)
+        layers = [torch.randn(5, 3, 8) for _ in range(4)]
+        history = LearnableDenseLayerHistory(_history_args(True, softmax_weight=True), is_encoder=True)
+        history.eval()
+        with torch.no_grad():
+            ref = self._run(history, layers)
+            table = history.weight_table
+            self._run(history, layers)
+            self.assertIs(history.weight_table, table)
+
+            # a new state dict or train() drops the cached table
+            history.load_state_dict({'weight': torch.randn(4, 4), 'norm_weight': history.norm_weight,
+                                     'norm_bias': history.norm_bias})
+            self.assertIsNone(history.weight_table)
+            out = self._run(history, layers)
+            self.assertFalse(torch.allclose(out[-1], ref[-1]))
+            history.train()
+            self.assertIsNone(history.weight_table)
+
+    def test_upgrade_layer_norms(self):
+        history = LearnableDenseLayerHistory(_history_args(True), is_encoder=True)
+        state_dict = {'encoder.history.weight': history.weight.detach()}
+        for i in range(3):
+            state_dict['encoder.history.layer_norms.{}.weight'.format(i)] = torch.full((8,), float(i))
+            state_dict['encoder.history.layer_norms.{}.bias'.format(i)] = torch.full((8,), -float(i))
+        history.upgrade_state_dict_named(state_dict, 'encoder.history')
+        history.load_state_dict({k[len('encoder.history.'):]: v for k, v in state_dict.items()})
+        self.assertEqual(history.norm_weight[:, 0].tolist(), [0., 1., 2.])
+        self.assertEqual(history.norm_bias[:, 0].tolist(), [0., -1., -2.])
+
+    def _stack_and_load(self, legacy):
+        torch.manual_seed(0)
+        model = _GrowingEncoderModel(_growing_args(2))
+        with torch.no_grad():
+            model.encoder.history.norm_weight.uniform_(0.5, 1.5)
+            model.encoder.history.norm_bias.uniform_(-0.5, 0.5)
+        state = model.state_dict()
+        if legacy:
+            for m in ('weight', 'bias'):
+                for i, row in enumerate(state.pop('encoder.history.norm_' + m)):
+                    state['encoder.history.layer_norms.{}.{}'.format(i, m)] = row.clone()
+        ckpt = {
+            'args': _growing_args(2),
+            'model': state,
+            'optimizer_history': [{
+                'criterion_name': 'CrossEntropyCriterion',
+                'optimizer_name': 'FairseqNAG',
+                'lr_scheduler_state': {'best': None},
+                'num_updates': 0,
+            }],
+            'last_optimizer_state': None,
+            'extra_state': {'train_iterator': {'epoch': 1}},
+        }
+        if hasattr(torch.serialization, 'add_safe_globals'):
+            # the checkpoint stores its args as a Namespace
+            torch.serialization.add_safe_globals([argparse.Namespace])
+
+        grown = _GrowingEncoderModel(_growing_args(3))
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = os.path.join(tmp, 'small.pt'), os.path.join(tmp, 'stacked.pt')
+            torch.save(ckpt, src)
+            with mock.patch.object(sys, 'argv', ['stack.py', src, dst, '1']), \
+                    mock.patch.object(stack, 'strategy', 1):
+                stack.main()
+            utils.load_model_state(dst, grown)
+
+        old, new = model.encoder, grown.encoder
+        self.assertTrue(torch.equal(new.layers[2].weight, old.layers[1].weight))
+        # the copied top norm and the identity reset of row len(k) - 2
+        self.assertTrue(torch.equal(new.history.norm_weight[0], old.history.norm_weight[0]))
+        self.assertTrue(torch.equal(new.history.norm_weight[2], old.history.norm_weight[1]))
+        self.assertTrue(torch.equal(new.history.norm_weight[1], torch.ones(8)))
+        self.assertTrue(torch.equal(new.history.norm_bias[1], torch.zeros(8)))
+        self.assertTrue(torch.equal(new.history.weight[:3, :3], old.history.weight.tril()))
+
+    def test_stack_and_load_round_trip(self):
+        self._stack_and_load(legacy=False)
+
+    def test_stack_and_load_legacy_round_trip(self):
+        self._stack_and_load(legacy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from fairseq.modules import MultiheadAttention
+
+
+class TestMultiheadAttention(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.attn = MultiheadAttention(16, 4)
+        self.attn.eval()
+        self.x = torch.randn(5, 2, 16)
+        self.key_padding_mask = torch.tensor([
+            [False, False, False, False, False],
+            [False, False, False, True, True],
+        ])
+        self.future_mask = torch.triu(torch.full((5, 5), float('-inf')), 1)
+
+    @unittest.skipIf(not hasattr(F, 'scaled_dot_product_attention'), 'requires scaled_dot_product_attention')
+    def test_fused_matches_reference(self):
+        # need_weights=True always takes the bmm/softmax path
+        ref, _ = self.attn(
+            self.x, self.x, self.x, key_padding_mask=self.key_padding_mask,
+            attn_mask=self.future_mask, need_weights=True,
+        )
+        out, weights = self.attn(
+            self.x, self.x, self.x, key_padding_mask=self.key_padding_mask,
+            attn_mask=self.future_mask, need_weights=False,
+        )
+        self.assertIsNone(weights)
+        self.assertTrue(torch.allclose(ref, out, atol=1e-6))
+
+    def test_additive_padding_mask(self):
+        bias = torch.zeros(self.key_padding_mask.size()).masked_fill_(self.key_padding_mask, float('-inf'))
+        for need_weights in (True, False):
+            ref, _ = self.attn(
+                self.x, self.x, self.x, key_padding_mask=self.key_padding_mask,
+                need_weights=need_weights,
+            )
+            out, _ = self.attn(
+                self.x, self.x, self.x, key_padding_mask=bias,
+                need_weights=need_weights,
+            )
+            self.assertTrue(torch.allclose(ref, out, atol=1e-6))
+
+    def test_is_causal(self):
+        x = self.x.clone().requires_grad_()
+        for need_weights in (True, False):
+            ref, _ = self.attn(
+                x, x, x, attn_mask=self.future_mask,
+                need_weights=need_weights,
+            )
+            ref_grad, = torch.autograd.grad(ref.sum(), x)
+            out, _ = self.attn(
+                x, x, x, attn_mask=self.future_mask,
+                need_weights=need_weights, is_causal=True,
+            )
+            out_grad, = torch.autograd.grad(out.sum(), x)
+            self.assertTrue(torch.allclose(ref, out, atol=1e-6))
+            self.assertTrue(torch.allclose(ref_grad, out_grad, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
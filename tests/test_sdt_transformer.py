@@ -0,0 +1,169 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import argparse
+import unittest
+
+import torch
+
+from fairseq.models.sdt_transformer import SdtTransformerModel, base_architecture
+from tests.utils import dummy_dictionary
+
+
+class _DummyTask(object):
+
+    def __init__(self, dictionary):
+        self.source_dictionary = dictionary
+        self.target_dictionary = dictionary
+
+
+def _build_model(**overrides):
+    parser = argparse.ArgumentParser()
+    SdtTransformerModel.add_args(parser)
+    args = parser.parse_args([])
+    args.encoder_embed_dim = args.decoder_embed_dim = 16
+    args.encoder_ffn_embed_dim = args.decoder_ffn_embed_dim = 32
+    args.encoder_attention_heads = args.decoder_attention_heads = 2
+    args.encoder_layers = args.decoder_layers = 4
+    args.encoder_normalize_before = args.decoder_normalize_before = True
+    args.encoder_history_type = 'learnable_dense'
+    args.decoder_history_type = 'learnable_dense'
+    args.k = [0, 2, 4]
+    args.dropout = args.attention_dropout = args.relu_dropout = 0.1
+    for k, v in overrides.items():
+        setattr(args, k, v)
+    base_architecture(args)
+    return SdtTransformerModel.build_model(args, _DummyTask(dummy_dictionary(10)))
+
+
+class TestSdtTransformer(unittest.TestCase):
+
+    def _train_step(self, model):
+        model.train()
+        torch.manual_seed(1)
+        src_tokens = torch.randint(4, 14, (2, 6))
+        prev_output_tokens = torch.randint(4, 14, (2, 5))
+        src_lengths = torch.tensor([6, 6])
+        out, _ = model(src_tokens, src_lengths, prev_output_tokens)
+        out.sum().backward()
+        return out, [p.grad.clone() for p in model.parameters() if p.grad is not None]
+
+    def test_checkpoint_activations_with_dropout(self):
+        torch.manual_seed(0)
+        model = _build_model(checkpoint_activations=True)
+        out, grads = self._train_step(model)
+
+        # same forward and gradients as storing the activations
+        model.zero_grad()
+        model.encoder.checkpoint_activations = False
+        model.decoder.checkpoint_activations = False
+        ref, ref_grads = self._train_step(model)
+        self.assertTrue(torch.allclose(out, ref, atol=1e-5))
+        self.assertEqual(len(grads), len(ref_grads))
+        for g, ref_g in zip(grads, ref_grads):
+            self.assertTrue(torch.allclose(g, ref_g, atol=1e-5))
+
+    def test_logits_keep_model_dtype(self):
+        # only --bf16-autocast upcasts the logits; log_softmax works in fp32
+        model = _build_model().to(torch.bfloat16).eval()
+        src_tokens = torch.randint(4, 14, (2, 6))
+        out, _ = model(src_tokens, torch.tensor([6, 6]), torch.randint(4, 14, (2, 5)))
+        self.assertEqual(out.dtype, torch.bfloat16)
+
+    def test_bf16_autocast_follows_input_device(self):
+        model = _build_model(bf16_autocast=True).eval()
+        dtypes = []
+        model.decoder.layers[0].fc1.register_forward_hook(lambda m, i, o: dtypes.append(o.dtype))
+        src_tokens = torch.randint(4, 14, (2, 6))
+        out, _ = model(src_tokens, torch.tensor([6, 6]), torch.randint(4, 14, (2, 5)))
+        self.assertEqual(dtypes, [torch.bfloat16])
+        self.assertEqual(out.dtype, torch.float32)
+
+    def test_quantize_for_inference(self):
+        torch.manual_seed(0)
+        model = _build_model().eval()
+        src_tokens = torch.randint(4, 14, (2, 6))
+        prev_output_tokens = torch.randint(4, 14, (2, 5))
+        with torch.no_grad():
+            ref, _ = model(src_tokens, torch.tensor([6, 6]), prev_output_tokens)
+            model.quantize_for_inference()
+            out, _ = model(src_tokens, torch.tensor([6, 6]), prev_output_tokens)
+        self.assertNotIsInstance(model.decoder.layers[0].fc1, torch.nn.Linear)
+        self.assertLess((out - ref).abs().max().item(), 0.1)
+
+    def test_bf16_generation_incremental_matches_full(self):
+        torch.manual_seed(0)
+        model = _build_model(bf16_autocast=True).eval()
+        model.make_generation_fast_()
+        self.assertEqual(model.decoder.layer_dtype, torch.bfloat16)
+        src_tokens = torch.randint(4, 14, (2, 6))
+        prev_output_tokens = torch.randint(4, 14, (2, 5))
+        with torch.no_grad():
+            encoder_out = model.encoder(src_tokens, torch.tensor([6, 6]))
+            ref, _ = model.decoder(prev_output_tokens, encoder_out)
+            incremental_state = {}
+            out = torch.cat([
+                model.decoder(prev_output_tokens[:, :t + 1], encoder_out, incremental_state)[0]
+                for t in range(prev_output_tokens.size(1))
+            ], dim=1)
+        self.assertEqual(encoder_out['encoder_out'].dtype, torch.float32)
+        self.assertTrue(torch.allclose(out, ref, atol=5e-2))
+
+    def test_fp8_kv_cache(self):
+        torch.manual_seed(0)
+        model = _build_model(fp8_kv_cache=True).eval()
+        src_tokens = torch.randint(4, 14, (2, 6))
+        prev_output_tokens = torch.randint(4, 14, (2, 5))
+        with torch.no_grad():
+            encoder_out = model.encoder(src_tokens, torch.tensor([6, 6]))
+            ref, _ = model.decoder(prev_output_tokens, encoder_out)
+            incremental_state = {}
+            out = []
+            for t in range(prev_output_tokens.size(1)):
+                out.append(model.decoder(prev_output_tokens[:, :t + 1], encoder_out, incremental_state)[0])
+                if t == 2:
+                    # beam search reorders the uint8 buffers and their scales
+                    model.decoder.reorder_incremental_state(incremental_state, torch.tensor([0, 1]))
+            out = torch.cat(out, dim=1)
+
+            self_attn = model.decoder.layers[0].self_attn
+            saved_state = self_attn._get_input_buffer(incremental_state)
+            self.assertNotIn('prev_key', saved_state)
+            self.assertEqual(saved_state['prev_key_fp8'].dtype, torch.uint8)
+            self.assertEqual(saved_state['prev_key_fp8'].size(2), prev_output_tokens.size(1))
+
+            # swapping the two sentences swaps their cached keys/values
+            cached = {k: v.clone() for k, v in saved_state.items()}
+            model.decoder.reorder_incremental_state(incremental_state, torch.tensor([1, 0]))
+            saved_state = self_attn._get_input_buffer(incremental_state)
+            for k, v in cached.items():
+                self.assertTrue(torch.equal(saved_state[k], v.flip(0)))
+        self.assertTrue(torch.allclose(out, ref, atol=5e-2))
+
+    def test_project_encoder_kv(self):
+        torch.manual_seed(0)
+        model = _build_model().eval()
+        src_tokens = torch.randint(4, 14, (2, 6))
+        with torch.no_grad():
+            enc = model.encoder(src_tokens, torch.tensor([6, 6]))['encoder_out']
+            for generation_fast in (False, True):
+                if generation_fast:
+                    model.make_generation_fast_()
+                    self.assertIsNotNone(model.decoder._encoder_kv_weight)
+                incremental_state = {}
+                self.assertTrue(model.decoder._project_encoder_kv(enc, incremental_state))
+                for layer in model.decoder.layers:
+                    attn = layer.encoder_attn
+                    saved_state = attn._get_input_buffer(incremental_state)
+                    for name, ref in zip(('prev_key', 'prev_value'), attn.in_proj_kv(enc)):
+                        # (src_len, bsz, embed_dim) -> (bsz, num_heads, src_len, head_dim)
+                        ref = ref.view(6, 2, attn.num_heads, attn.head_dim).permute(1, 2, 0, 3)
+                        self.assertTrue(torch.allclose(saved_state[name], ref, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
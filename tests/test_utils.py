@@ -76,6 +76,16 @@ class TestUtils(unittest.TestCase):
             utils.make_positions(right_pad_input, pad, left_pad=False),
         )
 
+    def test_skip_init_weights(self):
+        w = torch.zeros(4, 4)
+        with utils.skip_init_weights():
+            torch.nn.init.xavier_uniform_(w)
+        self.assertEqual(utils.item(w.abs().sum()), 0)
+
+        # the init functions are restored on exit
+        torch.nn.init.xavier_uniform_(w)
+        self.assertGreater(utils.item(w.abs().sum()), 0)
+
     def assertAlmostEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
         self.assertLess(utils.item((t1 - t2).abs().max()), 1e-4)